@@ -0,0 +1,95 @@
+"""
+Downloads of /static/get/ against the MinIO stand-in of bench/fake_s3.py, with and without the disk cache.
+
+A home page load fetches the same few carousel images: the bench uploads `--objects` images, then
+downloads each of them `--rounds` times, `--concurrency` at a time, and prints the latency and the
+number of requests which reached the store, for STATIC_CACHE_SIZE=0 and for the default cache.
+
+    python bench/download.py --objects 5 --size-kb 300 --rounds 40 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+_root = tempfile.mkdtemp(prefix="fake-s3-")
+_sock = socket.socket()
+_sock.bind(("127.0.0.1", 0))
+os.environ["MINIO_ENDPOINT"] = f"127.0.0.1:{_sock.getsockname()[1]}"
+os.environ.setdefault("STATIC_CACHE_DIR", os.path.join(_root, "cache"))
+# keep the import of sql_app away from the real database
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_root}/download.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import main  # noqa: E402
+from fake_s3 import create_app  # noqa: E402
+from obj_storage.client import bucket_name  # noqa: E402
+from obj_storage.disk_cache import static_cache  # noqa: E402
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 12
+
+
+def serve_fake_s3() -> dict:
+    os.makedirs(os.path.join(_root, bucket_name), exist_ok=True)
+    app = create_app(_root)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [_sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return app.state.fake
+
+
+async def run(objects: int, size: int, rounds: int, concurrency: int) -> None:
+    stats = serve_fake_s3()
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            names = []
+            for i in range(objects):
+                r = await client.post("/static/upload/", files={"file": (f"{i}.jpg", JPEG + os.urandom(size), "image/jpeg")})
+                names.append(r.json()["object_name"])
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(name: str, latencies: list[float]):
+                async with semaphore:
+                    start = time.perf_counter()
+                    r = await client.get(f"/static/get/{name}")
+                    r.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+
+            max_bytes = static_cache.max_bytes
+            for label, enabled in (("no cache", False), ("disk cache", True)):
+                static_cache.max_bytes = max_bytes if enabled else 0
+                static_cache.invalidate(*names)
+                latencies: list[float] = []
+                before = stats["requests"]
+                start = time.perf_counter()
+                await asyncio.gather(*(one(name, latencies) for _ in range(rounds) for name in names))
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{label:>10}: {len(latencies) / elapsed:7.1f} downloads/s"
+                    f"  p50 {statistics.median(latencies) * 1000:6.2f} ms"
+                    f"  p95 {sorted(latencies)[int(len(latencies) * 0.95)] * 1000:6.2f} ms"
+                    f"  store requests {stats['requests'] - before}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=5)
+    parser.add_argument("--size-kb", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.objects, args.size_kb * 1024, args.rounds, args.concurrency))
@@ -0,0 +1,99 @@
+"""
+A local stand-in for the CAS server of SDU, for benchmarking the login offline.
+
+It implements the three endpoints used by src/sdu_sso.py. Any username is accepted
+with any password except "wrong". Every response is delayed by `delay` seconds to
+simulate a slow server.
+
+Use it in-process through httpx.ASGITransport(create_app(...)), or run it:
+
+    python bench/fake_cas.py --port 8900 --delay 0.05
+
+and start the backend with SDU_SSO_BASE_URL=http://127.0.0.1:8900/
+"""
+
+import argparse
+import asyncio
+import itertools
+from urllib.parse import parse_qs
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+
+SERVICE_RESPONSE = """<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas" xmlns:sso="http://sso.sdu.edu.cn/user">
+    <cas:authenticationSuccess>
+        <cas:user>{sdu_id}</cas:user>
+        <cas:attributes>
+            <cas:USER_NAME>{name}</cas:USER_NAME>
+            <sso:user>{sdu_id}</sso:user>
+        </cas:attributes>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>"""
+
+WRONG_PASSWORD = "wrong"
+
+
+def create_app(delay: float = 0.0) -> Starlette:
+    counter = itertools.count(1)
+    tickets: dict[str, str] = {}  # TGT or ST -> username
+    app_state = {"delay": delay, "requests": 0}
+
+    async def _wait():
+        app_state["requests"] += 1
+        if app_state["delay"]:
+            await asyncio.sleep(app_state["delay"])
+
+    async def grant_ticket(request: Request) -> Response:
+        await _wait()
+        form = parse_qs((await request.body()).decode())
+        username = form.get("username", [""])[0]
+        if not username or form.get("password", [""])[0] == WRONG_PASSWORD:
+            return PlainTextResponse("Invalid credentials", status_code=400)
+        tgt = f"TGT-{next(counter)}-fake"
+        tickets[tgt] = username
+        return PlainTextResponse(tgt, status_code=201)
+
+    async def service_ticket(request: Request) -> Response:
+        await _wait()
+        username = tickets.pop(request.path_params["tgt"], None)
+        if username is None:
+            return PlainTextResponse("Invalid ticket", status_code=404)
+        st = f"ST-{next(counter)}-fake"
+        tickets[st] = username
+        return PlainTextResponse(st)
+
+    async def service_validate(request: Request) -> Response:
+        await _wait()
+        username = tickets.pop(request.query_params.get("ticket", ""), None)
+        if username is None:
+            return Response(
+                '<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">'
+                '<cas:authenticationFailure code="INVALID_TICKET"/></cas:serviceResponse>',
+                media_type="application/xml",
+            )
+        return Response(
+            SERVICE_RESPONSE.format(sdu_id=username, name=f"User {username}"),
+            media_type="application/xml",
+        )
+
+    app = Starlette(
+        routes=[
+            Route("/cas/restlet/tickets", grant_ticket, methods=["POST"]),
+            Route("/cas/restlet/tickets/{tgt}", service_ticket, methods=["POST"]),
+            Route("/cas/serviceValidate", service_validate, methods=["GET"]),
+        ]
+    )
+    app.state.fake = app_state
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.delay), host="127.0.0.1", port=args.port)
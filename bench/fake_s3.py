@@ -0,0 +1,206 @@
+"""
+A local stand-in for MinIO, for trying src/obj_storage offline.
+
+It implements the part of the S3 API used by the minio client of src/obj_storage/client.py:
+buckets, single and multipart uploads, ranged downloads, stats, deletes and ListObjectsV2.
+Requests are not authenticated. The objects are stored as files under `root`/bucket, their ETag
+and type under `root`/.meta, and the app counts the requests and bytes it received, to check
+how the uploads were sent.
+
+The minio client talks HTTP to a host, so the stand-in has to be served:
+
+    python bench/fake_s3.py --port 9900 --root /tmp/fake-s3
+
+and start the backend with MINIO_ENDPOINT=127.0.0.1:9900
+"""
+
+import argparse
+import email.utils
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.routing import Route
+
+XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def _xml(body: str, status_code: int = 200) -> Response:
+    return Response(f'<?xml version="1.0" encoding="UTF-8"?>\n{body}', status_code, media_type="application/xml")
+
+
+def _error(code: str, status_code: int, resource: str = "") -> Response:
+    return _xml(f"<Error><Code>{code}</Code><Message>{code}</Message><Resource>{escape(resource)}</Resource></Error>", status_code)
+
+
+def create_app(root: str) -> Starlette:
+    base = Path(root)
+    uploads, metas = base / ".uploads", base / ".meta"
+    uploads.mkdir(parents=True, exist_ok=True)
+    upload_ids = itertools.count(1)
+    stats = {"requests": 0, "bytes_received": 0, "single_puts": 0, "multipart_uploads": 0, "parts": 0, "aborts": 0}
+
+    def object_path(bucket: str, key: str) -> Path:
+        return base / bucket / key
+
+    def meta_path(path: Path) -> Path:
+        return metas / path.relative_to(base)
+
+    def meta(path: Path) -> dict:
+        return json.loads(meta_path(path).read_text())
+
+    def store(path: Path, etag: str, content_type: str | None) -> None:
+        meta_path(path).parent.mkdir(parents=True, exist_ok=True)
+        meta_path(path).write_text(json.dumps({"etag": etag, "type": content_type or "application/octet-stream"}))
+
+    async def receive_to(request: Request, path: Path) -> str:
+        md5 = hashlib.md5()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+                md5.update(chunk)
+                stats["bytes_received"] += len(chunk)
+        return md5.hexdigest()
+
+    def object_headers(path: Path) -> dict[str, str]:
+        m = meta(path)
+        return {
+            "ETag": f'"{m["etag"]}"',
+            "Last-Modified": email.utils.formatdate(path.stat().st_mtime, usegmt=True),
+            "Content-Type": m["type"],
+            "Accept-Ranges": "bytes",
+        }
+
+    def list_objects(bucket: str, request: Request) -> Response:
+        q = request.query_params
+        prefix = q.get("prefix", "")
+        after = q.get("continuation-token") or q.get("start-after", "")
+        max_keys = int(q.get("max-keys", "1000"))
+        bucket_dir = base / bucket
+        keys = sorted(str(p.relative_to(bucket_dir)) for p in bucket_dir.rglob("*") if p.is_file())
+        keys = [k for k in keys if k.startswith(prefix) and k > after]
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(k)}</Key>"
+            f"<LastModified>{datetime.fromtimestamp((bucket_dir / k).stat().st_mtime, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<ETag>&quot;{escape(meta(bucket_dir / k)['etag'])}&quot;</ETag><Size>{(bucket_dir / k).stat().st_size}</Size>"
+            f"<StorageClass>STANDARD</StorageClass></Contents>"
+            for k in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        return _xml(
+            f'<ListBucketResult xmlns="{XMLNS}"><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>'
+            f"<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{contents}</ListBucketResult>"
+        )
+
+    async def bucket_op(request: Request) -> Response:
+        stats["requests"] += 1
+        bucket = request.path_params["bucket"]
+        if request.method == "PUT":
+            (base / bucket).mkdir(exist_ok=True)
+            return Response()
+        if not (base / bucket).is_dir():
+            return _error("NoSuchBucket", 404, bucket)
+        if request.method == "HEAD":
+            return Response()
+        if "location" in request.query_params:
+            return _xml(f'<LocationConstraint xmlns="{XMLNS}"></LocationConstraint>')
+        return list_objects(bucket, request)
+
+    async def object_op(request: Request) -> Response:
+        stats["requests"] += 1
+        bucket, key = request.path_params["bucket"], request.path_params["key"]
+        q = request.query_params
+        path = object_path(bucket, key)
+        if not (base / bucket).is_dir():
+            return _error("NoSuchBucket", 404, bucket)
+
+        if request.method == "POST" and "uploads" in q:
+            upload_id = f"upload-{next(upload_ids)}"
+            (uploads / upload_id).mkdir()
+            (uploads / upload_id / "type").write_text(request.headers.get("content-type", ""))
+            stats["multipart_uploads"] += 1
+            return _xml(
+                f'<InitiateMultipartUploadResult xmlns="{XMLNS}"><Bucket>{bucket}</Bucket>'
+                f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+        if "uploadId" in q:
+            upload = uploads / q["uploadId"]
+            if not upload.is_dir():
+                return _error("NoSuchUpload", 404, key)
+            if request.method == "PUT":
+                etag = await receive_to(request, upload / f"{int(q['partNumber']):05d}")
+                stats["parts"] += 1
+                return Response(headers={"ETag": f'"{etag}"'})
+            if request.method == "DELETE":
+                shutil.rmtree(upload)
+                stats["aborts"] += 1
+                return Response(status_code=204)
+            # complete
+            await request.body()
+            parts = sorted(p for p in upload.iterdir() if p.name != "type")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            md5s = []
+            with open(path, "wb") as f:
+                for part in parts:
+                    data = part.read_bytes()
+                    md5s.append(hashlib.md5(data).digest())
+                    f.write(data)
+            etag = f"{hashlib.md5(b''.join(md5s)).hexdigest()}-{len(parts)}"
+            store(path, etag, (upload / "type").read_text())
+            shutil.rmtree(upload)
+            return _xml(
+                f'<CompleteMultipartUploadResult xmlns="{XMLNS}"><Location>/{bucket}/{escape(key)}</Location>'
+                f"<Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><ETag>\"{etag}\"</ETag></CompleteMultipartUploadResult>"
+            )
+
+        if request.method == "PUT":
+            etag = await receive_to(request, path)
+            store(path, etag, request.headers.get("content-type"))
+            stats["single_puts"] += 1
+            return Response(headers={"ETag": f'"{etag}"'})
+        if not path.is_file():
+            return _error("NoSuchKey", 404, key)
+        if request.method == "DELETE":
+            path.unlink()
+            meta_path(path).unlink(missing_ok=True)
+            return Response(status_code=204)
+        headers = object_headers(path)
+        if request.method == "HEAD":
+            return Response(headers={**headers, "Content-Length": str(path.stat().st_size)})
+        # FileResponse answers Range requests with 206
+        return FileResponse(path, headers=headers, media_type=headers.pop("Content-Type"))
+
+    app = Starlette(
+        routes=[
+            Route("/{bucket}", bucket_op, methods=["GET", "HEAD", "PUT"]),
+            Route("/{bucket}/", bucket_op, methods=["GET", "HEAD", "PUT"]),
+            Route("/{bucket}/{key:path}", object_op, methods=["GET", "HEAD", "PUT", "POST", "DELETE"]),
+        ]
+    )
+    app.state.fake = stats
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--root", default=None, help="directory of the objects, a temporary one by default")
+    parser.add_argument("--bucket", default="what-to-eat-temporary", help="bucket created at startup")
+    args = parser.parse_args()
+    root = args.root or tempfile.mkdtemp(prefix="fake-s3-")
+    os.makedirs(os.path.join(root, args.bucket), exist_ok=True)
+    uvicorn.run(create_app(root), host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,446 @@
+"""
+Load test of the whole app, in-process: mixes of requests modelled on the traffic of the canteens,
+sent to main.app through httpx's ASGITransport (no server, no network).
+
+- browse: the home page at lunchtime, i.e. canteens, carousel, new dishes, the dishes of a canteen
+  or a floor, then a few dishes and their comments. The lists are revalidated with their ETags.
+- random: "what to eat today", /dish/{canteen}/random with the various filters and weightings.
+- typing: search-as-you-type, /dish/suggest on every prefix of a name then /dish/search/.
+- burst: everybody marking and rating the same few dishes after lunch (POST /marks, POST /comments/).
+- import: an admin re-importing the menu of a canteen with new prices (POST /dish/excel, upsert).
+
+The database is a temporary SQLite file seeded with --canteens x 3 floors x 10 windows x
+--dishes-per-window dishes and --users users. Each mix runs --concurrency clients for --seconds
+(after --warmup seconds which are not measured), and prints per route: requests, errors (status 500
+and above), latency p50/p95/p99, throughput and the SQL statements run per request. The latency is measured inside the app, from the call of the ASGI app to its return.
+
+With --out, the results are saved as JSON with the commit and the settings of the run (DB_MODE,
+SQLITE_PROFILE, FAST_JSON...), so that runs can be compared across commits with --compare:
+
+    python bench/harness.py --seconds 10 --out before.json
+    git checkout <branch>
+    python bench/harness.py --seconds 10 --out after.json --compare before.json
+    python bench/harness.py --mix browse --mix typing --concurrency 16
+"""
+
+import argparse
+import asyncio
+import contextvars
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# keep the import of sql_app away from the real database
+_tmp = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{_tmp}/harness.db"
+# the lag of the loop is what is measured here, not something to warn about
+os.environ.setdefault("LOOP_LAG_THRESHOLD_MS", "10000")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import httpx  # noqa: E402
+import pandas as pd  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+
+import loop_monitor  # noqa: E402
+import main  # noqa: E402
+from sql_app import async_engine, async_read_engine, engine, read_engine  # noqa: E402
+from sql_app.models import Canteen, Carousel, Comment, Dish, Floor, NewDish, User  # noqa: E402
+from users import create_token  # noqa: E402
+
+FLOORS, WINDOWS = 3, 10
+CAMPUSES = ("中心", "软件园", "兴隆山")
+COOKING = ("红烧", "清蒸", "麻辣", "香煎", "糖醋", "宫保", "鱼香", "干煸", "酸菜", "黄焖")
+INGREDIENTS = ("牛肉", "鸡丁", "排骨", "豆腐", "茄子", "鱼块", "肉丝", "土豆", "虾仁", "鸡腿")
+DISH_NAMES = [f"{cooking}{ingredient}" for cooking in COOKING for ingredient in INGREDIENTS]
+HOT_DISHES = 20
+
+# the statements run by the current request, shared with the threadpool and the greenlets it spawns
+_statements: contextvars.ContextVar[list[int] | None] = contextvars.ContextVar("statements", default=None)
+
+
+def _count_statement(*args) -> None:
+    counter = _statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+for e in {engine, read_engine, async_engine, async_read_engine} - {None}:
+    event.listen(getattr(e, "sync_engine", e), "before_cursor_execute", _count_statement)
+
+
+class Recorder:
+    """
+    Wraps the ASGI app and records the route, status, latency and statement count of every request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = False
+        self.samples: list[tuple[str, int, float, int]] = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 0
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        counter = [0]
+        token = _statements.set(counter)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        except Exception:
+            status = status or 500
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _statements.reset(token)
+            if self.enabled:
+                self.samples.append((loop_monitor.route_of(scope), status, elapsed, counter[0]))
+
+
+class Data:
+    """
+    What the clients know of the seeded database.
+    """
+
+    def __init__(self, canteens: int, dishes_per_window: int, users: int, seed: int):
+        self.canteens = canteens
+        self.dishes: list[dict] = []
+        self.users = list(range(1, users + 1))
+        self.rng = random.Random(seed)
+        self.tokens: dict[int, str] = {}
+        self.admin_token = ""
+        self.dishes_per_window = dishes_per_window
+        # (user, dish) pairs already rated: a user comments on a dish once
+        self.rated: set[tuple[int, int]] = set()
+        # canteen -> its last import round, and the lock serializing its imports as a single admin would
+        self.rounds: Counter[int] = Counter()
+        self.import_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def seed(self) -> None:
+        rng = self.rng
+        with engine.begin() as conn:
+            conn.execute(insert(User), [{"id": u, "username": f"user{u}", "sdu_id": str(202200000000 + u)} for u in self.users])
+            conn.execute(
+                insert(Canteen),
+                [
+                    {"id": c, "name": f"第{c}餐厅", "description": "", "campus": CAMPUSES[c % len(CAMPUSES)], "floors_count": FLOORS}
+                    for c in range(1, self.canteens + 1)
+                ],
+            )
+            conn.execute(
+                insert(Floor),
+                [
+                    {"canteen": c, "floor_in_canteen": f, "count_of_windows": WINDOWS}
+                    for c in range(1, self.canteens + 1)
+                    for f in range(1, FLOORS + 1)
+                ],
+            )
+            self.dishes = [
+                {
+                    "canteen": c,
+                    "floor": f,
+                    "window": w,
+                    "name": name,
+                    "measure": "份",
+                    "price": f"{rng.randint(6, 25)}.{rng.choice((0, 5))}0",
+                    "image": f"{rng.getrandbits(64):016x}.jpg" if rng.random() < 0.7 else None,
+                }
+                for c in range(1, self.canteens + 1)
+                for f in range(1, FLOORS + 1)
+                for w in range(1, WINDOWS + 1)
+                for name in self.window_names()
+            ]
+            for i, dish in enumerate(self.dishes, 1):
+                dish["id"] = i
+            conn.execute(insert(Dish), self.dishes)
+            conn.execute(
+                insert(Carousel),
+                [{"canteen": c, "image": f"carousel-{c}-{i}.jpg"} for c in range(1, self.canteens + 1) for i in range(4)],
+            )
+            conn.execute(insert(NewDish), [{"dish_id": d["id"]} for d in rng.sample(self.dishes, 5 * self.canteens)])
+            comments = []
+            for dish in self.dishes[: len(self.dishes) // 4]:
+                for user in rng.sample(self.users, min(len(self.users), rng.randint(0, 6))):
+                    self.rated.add((user, dish["id"]))
+                    comments.append(
+                        {
+                            "user_id": user,
+                            "dish_id": dish["id"],
+                            "content": "好吃",
+                            "vote": rng.randint(1, 5),
+                            "content_visible": rng.random() < 0.5,
+                            "time": datetime.now(),
+                        }
+                    )
+            conn.execute(insert(Comment), comments)
+        self.tokens = {u: create_token(u, False, timedelta(hours=1)).access_token for u in self.users}
+        self.admin_token = create_token(self.users[0], True, timedelta(hours=1), privileges=["ALL"]).access_token
+
+    def window_names(self) -> list[str]:
+        """
+        The names of the dishes of a window, all different: a window with twice the same name is a
+        duplicate row of the menu sheets, which the import refuses.
+        """
+        names = self.rng.sample(DISH_NAMES, min(self.dishes_per_window, len(DISH_NAMES)))
+        # more dishes than names, e.g. --dishes-per-window 150
+        names += [f"{DISH_NAMES[i % len(DISH_NAMES)]}{i // len(DISH_NAMES)}" for i in range(len(names), self.dishes_per_window)]
+        return names
+
+    def menu_sheet(self, canteen: int, round_: int) -> bytes:
+        """
+        The menu of a canteen as an admin would export it, with a tenth of the prices changed by the round:
+        the prices of two consecutive rounds differ.
+        """
+        rows = [
+            {
+                "食堂": f"第{canteen}餐厅",
+                "楼层": d["floor"],
+                "窗口": d["window"],
+                "菜品": d["name"],
+                "单位": d["measure"],
+                "价格": float(d["price"]) + (round_ % 2) * 0.5 * (d["id"] % 10 == 0),
+            }
+            for d in self.dishes
+            if d["canteen"] == canteen
+        ]
+        buf = io.BytesIO()
+        pd.DataFrame(rows).to_excel(buf, index=False)
+        return buf.getvalue()
+
+
+class Client:
+    """
+    A phone: its own random stream and the ETags of the lists it has seen.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, data: Data, rng: random.Random):
+        self.http = http
+        self.data = data
+        self.rng = rng
+        self.etags: dict[str, str] = {}
+
+    async def poll(self, url: str) -> httpx.Response:
+        headers = {"If-None-Match": self.etags[url]} if url in self.etags else {}
+        r = await self.http.get(url, headers=headers)
+        if "ETag" in r.headers:
+            self.etags[url] = r.headers["ETag"]
+        return r
+
+    def auth(self, token: str) -> dict[str, str]:
+        return {"Authorization": f"Bearer {token}"}
+
+
+async def browse(client: Client) -> None:
+    rng, data = client.rng, client.data
+    canteen = rng.randint(1, data.canteens)
+    await client.poll("/canteen/all")
+    await client.poll(f"/carousel/{canteen}")
+    await client.poll(f"/new/{canteen}")
+    if rng.random() < 0.5:
+        await client.poll(f"/dish/{canteen}/all")
+    else:
+        await client.poll(f"/dish/{canteen}/{rng.randint(1, FLOORS)}/all")
+    for _ in range(rng.randint(1, 3)):
+        dish = rng.choice([d for d in data.dishes if d["canteen"] == canteen])["id"]
+        await client.http.get(f"/dish/{dish}")
+        await client.http.get(f"/comments/dish/{dish}", params={"limit": 20})
+
+
+async def random_dish(client: Client) -> None:
+    rng = client.rng
+    params = {"weighting": rng.choice(("uniform", "uniform", "average_vote", "count_of_mark"))}
+    if rng.random() < 0.5:
+        params["floor"] = rng.randint(1, FLOORS)
+        if rng.random() < 0.3:
+            params["window"] = rng.randint(1, WINDOWS)
+    await client.http.get(f"/dish/{rng.randint(1, client.data.canteens)}/random", params=params)
+
+
+async def typing(client: Client) -> None:
+    name = client.rng.choice(client.data.dishes)["name"]
+    for i in range(1, len(name) + 1):
+        await client.http.get("/dish/suggest", params={"q": name[:i]})
+    await client.http.get("/dish/search/", params={"s": name, "limit": 20})
+
+
+async def burst(client: Client) -> None:
+    rng, data = client.rng, client.data
+    user = rng.choice(data.users)
+    headers = client.auth(data.tokens[user])
+    # the few dishes everybody had for lunch
+    dish = rng.choice(data.dishes[:HOT_DISHES])["id"]
+    await client.http.post("/marks", json={"user_id": user, "dish_id": dish}, headers=headers)
+    if (user, dish) in data.rated:
+        dish = rng.choice(data.dishes)["id"]
+        if (user, dish) in data.rated:
+            return
+    data.rated.add((user, dish))
+    comment = {"user_id": user, "dish_id": dish, "content": rng.choice(("", "好吃", "一般", "太咸了")), "vote": rng.randint(1, 5)}
+    await client.http.post("/comments/", json=comment, headers=headers)
+
+
+async def excel_import(client: Client) -> None:
+    data = client.data
+    canteen = client.rng.randint(1, data.canteens)
+    async with data.import_locks[canteen]:
+        data.rounds[canteen] += 1
+        sheet = data.menu_sheet(canteen, data.rounds[canteen])
+        r = await client.http.post(
+            "/dish/excel",
+            params={"mode": "upsert"},
+            files={"file": ("menu.xlsx", sheet, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")},
+            headers=client.auth(data.admin_token),
+        )
+    # an import refused as invalid would only time the validation
+    result = r.json()
+    assert r.status_code == 200 and not result["errors"] and result["imported"] > 0, f"import wrote nothing: {r.status_code} {r.text[:200]}"
+
+
+# name -> the visit of a client, the share of --concurrency running it
+MIXES = {
+    "browse": (browse, 1.0),
+    "random": (random_dish, 1.0),
+    "typing": (typing, 1.0),
+    "burst": (burst, 1.0),
+    "import": (excel_import, 0.125),
+}
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    # nearest rank
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(samples: list[tuple[str, int, float, int]], elapsed: float) -> dict:
+    by_route: dict[str, list] = defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        latencies = sorted(r[2] for r in rows)
+        routes[route] = {
+            "requests": len(rows),
+            "errors": sum(r[1] >= 500 or r[1] == 0 for r in rows),
+            "statuses": dict(sorted(Counter(str(r[1]) for r in rows).items())),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "rps": len(rows) / elapsed,
+            "queries_per_request": statistics.fmean(r[3] for r in rows),
+        }
+    return {"elapsed": elapsed, "requests": len(samples), "rps": len(samples) / elapsed, "routes": routes}
+
+
+async def run_mix(http: httpx.AsyncClient, recorder: Recorder, data: Data, visit, clients: int, warmup: float, seconds: float, seed: int) -> dict:
+    async def client_loop(i: int, until: float):
+        client = Client(http, data, random.Random(seed * 1000 + i))
+        while time.perf_counter() < until:
+            await visit(client)
+
+    await asyncio.gather(*(client_loop(i, time.perf_counter() + warmup) for i in range(clients)))
+    recorder.samples = []
+    recorder.enabled = True
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop(clients + i, start + seconds) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    recorder.enabled = False
+    return summarize(recorder.samples, elapsed)
+
+
+def settings() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "env": {k: os.getenv(k) for k in ("DB_MODE", "SQLITE_PROFILE", "FAST_JSON", "DB_POOL_SIZE")},
+    }
+
+
+def print_mix(name: str, result: dict, baseline: dict | None) -> None:
+    print(f"\n{name}: {result['requests']} requests in {result['elapsed']:.1f}s, {result['rps']:.1f} req/s")
+    print(f"  {'route':<36} {'n':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'q/req':>6}")
+    for route, r in result["routes"].items():
+        line = (
+            f"  {route:<36} {r['requests']:>6} {r['errors']:>4} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}"
+            f" {r['p99_ms']:>8.2f} {r['rps']:>8.1f} {r['queries_per_request']:>6.1f}"
+        )
+        base = (baseline or {}).get("routes", {}).get(route)
+        if base:
+            line += (
+                f"   p95 {_delta(r['p95_ms'], base['p95_ms'])} req/s {_delta(r['rps'], base['rps'])}"
+                f" q/req {r['queries_per_request'] - base['queries_per_request']:+.1f}"
+            )
+        print(line)
+
+
+def _delta(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+6.1f}%" if old else "   n/a"
+
+
+async def run(args) -> dict:
+    data = Data(args.canteens, args.dishes_per_window, args.users, args.seed)
+    data.seed()
+    recorder = Recorder(main.app)
+    results = {}
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=recorder, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+            for name in args.mix or MIXES:
+                visit, share = MIXES[name]
+                clients = max(1, round(args.concurrency * share))
+                results[name] = await run_mix(http, recorder, data, visit, clients, args.warmup, args.seconds, args.seed)
+                results[name]["clients"] = clients
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", action="append", choices=list(MIXES), help="the mixes to run, all of them by default")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--canteens", type=int, default=4)
+    parser.add_argument("--dishes-per-window", type=int, default=15)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", type=Path, help="save the results as JSON")
+    parser.add_argument("--compare", type=Path, help="the JSON of a previous run, to print the changes against")
+    args = parser.parse_args()
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    results = asyncio.run(run(args))
+    report = {"settings": settings(), "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")}, "mixes": results}
+    if baseline:
+        print(f"compared with {baseline['settings']['commit']} of {baseline['settings']['time']}")
+    for name, result in results.items():
+        print_mix(name, result, (baseline or {}).get("mixes", {}).get(name))
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"\nsaved to {args.out}")
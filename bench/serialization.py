@@ -0,0 +1,127 @@
+"""
+Serialization of the dish lists: FastAPI's path (response_model validation, json encoding) against
+the orjson path of src/fast_json.py, on /dish/{canteen}/all and /dish/search/advanced.
+
+For each endpoint, it prints the time of the serialization alone and the latency of whole requests
+through the app (in-process, no network), and checks that both paths give the same JSON.
+
+    python bench/serialization.py --dishes 200 --requests 500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# keep the import of sql_app away from the real database
+_tmp = tempfile.mkdtemp()
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{_tmp}/serialization.db"
+# the serialization is timed on the event loop, outside of any request
+os.environ.setdefault("LOOP_LAG_THRESHOLD_MS", "10000")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import httpx  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+import fast_json  # noqa: E402
+import main  # noqa: E402
+from sql_app import SessionLocal, engine  # noqa: E402
+from sql_app.crud.dishes import advanced_search, get_all_by_canteen  # noqa: E402
+from sql_app.models import Dish  # noqa: E402
+from sql_app.schemas import AdvancedSearch, DishItem  # noqa: E402
+
+CANTEEN = 1
+
+
+def seed(dishes: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Dish),
+            [
+                {
+                    "canteen": CANTEEN,
+                    "floor": i % 3 + 1,
+                    "window": i % 20 + 1,
+                    "name": f"菜品 {i}",
+                    "measure": "份",
+                    "price": f"{8 + i % 17}.50",
+                    "average_vote": "3.75",
+                    "image": f"dish-{i}.jpg" if i % 2 else None,
+                }
+                for i in range(dishes)
+            ],
+        )
+
+
+_dish_list = TypeAdapter(list[DishItem])
+
+
+def fastapi_path(rows) -> bytes:
+    """What FastAPI does with the rows returned by a route with response_model=list[DishItem]."""
+    models = _dish_list.validate_python(rows, from_attributes=True)
+    return JSONResponse(_dish_list.dump_python(models, mode="json")).body
+
+
+def per_call(fn, rows, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(rows)
+    return (time.perf_counter() - start) / repeat
+
+
+async def latencies(client: httpx.AsyncClient, method: str, url: str, requests: int, **kwargs) -> list[float]:
+    out = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        r = await client.request(method, url, **kwargs)
+        out.append(time.perf_counter() - start)
+        r.raise_for_status()
+    return out
+
+
+async def run(dishes: int, requests: int) -> None:
+    seed(dishes)
+    with SessionLocal() as db:
+        rows = {
+            "/dish/{canteen}/all": get_all_by_canteen(db, CANTEEN),
+            "/dish/search/advanced": advanced_search(db, AdvancedSearch(canteen=[CANTEEN], limit=dishes)),
+        }
+    endpoints = {
+        "/dish/{canteen}/all": ("GET", f"/dish/{CANTEEN}/all", {}),
+        "/dish/search/advanced": ("POST", "/dish/search/advanced", {"params": {"canteen": CANTEEN, "limit": dishes}}),
+    }
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, (method, url, kwargs) in endpoints.items():
+                print(f"{name} ({len(rows[name])} dishes)")
+                slow = per_call(fastapi_path, rows[name], 50)
+                fast = per_call(lambda r: fast_json.dumps(DishItem, r), rows[name], 50)
+                print(f"  serialization   fastapi {slow * 1000:7.3f} ms   orjson {fast * 1000:7.3f} ms   x{slow / fast:.1f}")
+                bodies = {}
+                for enabled in (False, True):
+                    fast_json.ENABLED = enabled
+                    bodies[enabled] = (await client.request(method, url, **kwargs)).json()
+                    times = await latencies(client, method, url, requests, **kwargs)
+                    print(
+                        f"  {'orjson ' if enabled else 'fastapi'} requests  p50 {statistics.median(times) * 1000:7.3f} ms"
+                        f"   p95 {sorted(times)[int(len(times) * 0.95)] * 1000:7.3f} ms"
+                        f"   {len(times) / sum(times):7.1f} req/s"
+                    )
+                same = json.dumps(bodies[False], sort_keys=True) == json.dumps(bodies[True], sort_keys=True)
+                print(f"  same JSON: {same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dishes", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.dishes, args.requests))
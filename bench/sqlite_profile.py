@@ -0,0 +1,113 @@
+"""
+Throughput of a read/write mix on SQLite, before and after the tuning of src/sql_app/database.py.
+
+- before: SQLite's default pragmas, reads and writes on the same pool
+- after: the "wal" profile, reads on the read-only pool
+
+Threads stand for the threadpool running the crud functions: reads list the dishes of a floor
+and the comments of a dish, writes post a comment (which also updates the dish).
+
+    python bench/sqlite_profile.py --threads 32 --seconds 5 --write-ratio 0.2
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# keep the import of sql_app away from the real database
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_tmp}/import.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from sql_app import search  # noqa: E402
+from sql_app.crud.comment import get_comment_by_dish, post_comment  # noqa: E402
+from sql_app.crud.dishes import get_all_by_canteen  # noqa: E402
+from sql_app.database import create_engines  # noqa: E402
+from sql_app.models import Base, Dish  # noqa: E402
+from sql_app.schemas import CommentItem  # noqa: E402
+
+CANTEENS, FLOORS, WINDOWS, DISHES_PER_WINDOW = 4, 3, 10, 10
+
+
+def seed(path: str) -> None:
+    engine, _ = create_engines(f"sqlite:///{path}", "default")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Dish),
+            [
+                {"canteen": c, "floor": f, "window": w, "name": f"dish {c}-{f}-{w}-{i}", "measure": "份"}
+                for c in range(1, CANTEENS + 1)
+                for f in range(1, FLOORS + 1)
+                for w in range(1, WINDOWS + 1)
+                for i in range(DISHES_PER_WINDOW)
+            ],
+        )
+    engine.dispose()
+
+
+def run(profile: str, read_pool: bool, threads: int, seconds: float, write_ratio: float) -> dict:
+    path = os.path.join(_tmp, f"{profile}.db")
+    seed(path)
+    writer, reader = create_engines(f"sqlite:///{path}", profile)
+    for e in (writer, reader):
+        search.register_functions(e)
+    Write = sessionmaker(bind=writer, autoflush=False, expire_on_commit=False)
+    Read = sessionmaker(bind=reader if read_pool else writer, autoflush=False, expire_on_commit=False)
+    dishes = CANTEENS * FLOORS * WINDOWS * DISHES_PER_WINDOW
+    users = iter(range(1, 1 << 62))
+    lock = threading.Lock()
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            try:
+                if rng.random() < write_ratio:
+                    with lock:
+                        user = next(users)
+                    with Write() as db:
+                        post_comment(db, CommentItem(user_id=user, dish_id=rng.randint(1, dishes), content="ok", vote=4))
+                    kind = "writes"
+                else:
+                    with Read() as db:
+                        get_all_by_canteen(db, rng.randint(1, CANTEENS), rng.randint(1, FLOORS))
+                        get_comment_by_dish(db, rng.randint(1, dishes), filtered=False)
+                    kind = "reads"
+            except Exception:
+                kind = "errors"
+            with lock:
+                counts[kind] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        for i in range(threads):
+            pool.submit(worker, i)
+    elapsed = time.perf_counter() - start
+    writer.dispose()
+    reader.dispose()
+    return {**counts, "ops_per_second": (counts["reads"] + counts["writes"]) / elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+    for name, profile, read_pool in (("before", "default", False), ("after", "wal", True)):
+        r = run(profile, read_pool, args.threads, args.seconds, args.write_ratio)
+        print(
+            f"{name:6} ({profile}, {'read-only pool' if read_pool else 'single pool'}): "
+            f"{r['ops_per_second']:8.1f} ops/s  reads {r['reads']}  writes {r['writes']}  errors {r['errors']}"
+        )
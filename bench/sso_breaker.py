@@ -0,0 +1,74 @@
+"""
+Failure modes of the SSO client against a slow fake CAS server.
+
+1. The server answers slower than the client timeout: the first logins time out,
+   then the circuit opens and the next ones fail at once.
+2. The server recovers: after the reset timeout a trial request closes the circuit.
+
+    python bench/sso_breaker.py --logins 200 --delay 1 --timeout 0.2
+"""
+
+import argparse
+import asyncio
+import collections
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import sdu_sso  # noqa: E402
+from fake_cas import create_app  # noqa: E402
+from resilience import Bulkhead, CircuitBreaker  # noqa: E402
+
+
+async def attempt_logins(logins: int) -> tuple[collections.Counter, float]:
+    outcomes: collections.Counter = collections.Counter()
+
+    async def one(i: int):
+        try:
+            await sdu_sso.login(f"2024{i:08d}", "secret")
+            outcomes["ok"] += 1
+        except Exception as e:
+            outcomes[type(e).__name__] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(logins)))
+    return outcomes, time.perf_counter() - start
+
+
+async def run(logins: int, delay: float, timeout: float, reset_timeout: float) -> None:
+    fake = create_app(delay)
+    sdu_sso.configure(
+        base_url="http://fake-cas/",
+        transport=httpx.ASGITransport(app=fake),
+        timeout=httpx.Timeout(timeout),
+        deadline=timeout,
+    )
+    sdu_sso.breaker = CircuitBreaker(failure_threshold=5, reset_timeout=reset_timeout)
+    sdu_sso.bulkhead = Bulkhead(max_concurrent=20, max_wait=timeout * 2)
+
+    outcomes, elapsed = await attempt_logins(logins)
+    print(f"slow server ({delay}s, client timeout {timeout}s): {dict(outcomes)} in {elapsed:.2f}s")
+    print(f"  breaker: {sdu_sso.breaker.stats()}, bulkhead: {sdu_sso.bulkhead.stats()}")
+
+    fake.state.fake["delay"] = 0
+    await asyncio.sleep(reset_timeout)
+    outcomes, elapsed = await attempt_logins(logins)
+    print(f"recovered server: {dict(outcomes)} in {elapsed:.2f}s")
+    print(f"  breaker: {sdu_sso.breaker.stats()}")
+    print(f"  latency: {sdu_sso.latency.stats()}")
+    await sdu_sso.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=1.0, help="seconds added by the fake CAS server to every response")
+    parser.add_argument("--timeout", type=float, default=0.2, help="client timeout in seconds")
+    parser.add_argument("--reset-timeout", type=float, default=0.5, help="seconds the circuit stays open")
+    args = parser.parse_args()
+    asyncio.run(run(args.logins, args.delay, args.timeout, args.reset_timeout))
@@ -0,0 +1,64 @@
+"""
+Login throughput and latency of src/sdu_sso.py against the fake CAS server, offline.
+
+    python bench/sso_login.py --logins 2000 --concurrency 100 --delay 0.02
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import sdu_sso  # noqa: E402
+from fake_cas import create_app  # noqa: E402
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(logins: int, concurrency: int, delay: float) -> dict:
+    sdu_sso.configure(
+        base_url="http://fake-cas/", transport=httpx.ASGITransport(app=create_app(delay))
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await sdu_sso.get_user_name_and_id(await sdu_sso.login(f"2024{i:08d}", "secret"))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    await sdu_sso.aclose()
+    return {
+        "logins": logins,
+        "concurrency": concurrency,
+        "delay": delay,
+        "logins_per_second": logins / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.01, help="seconds added by the fake CAS server to every response")
+    args = parser.parse_args()
+    for key, value in asyncio.run(run(args.logins, args.concurrency, args.delay)).items():
+        print(f"{key:>18}: {value:.2f}" if isinstance(value, float) else f"{key:>18}: {value}")
@@ -0,0 +1,92 @@
+"""
+Consistency and latency of the autocompletion trie of src/sql_app/suggest.py, with the pinyin keys.
+
+It indexes --dishes random dish names, then renames and deletes --changes of them at random, as
+the dish routes do, and checks after every step that the suggestions of sampled prefixes (names,
+pinyin and initials) are the ones computed from scratch from the remaining dishes. Then it prints
+the latency of suggest() on the final trie.
+
+Needs the `pinyin` extra (pypinyin), whose keys are the part the other paths do not cover.
+
+    python bench/suggest.py --dishes 2000 --changes 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# keep the import of sql_app away from the real database
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_tmp}/suggest.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from sql_app import suggest  # noqa: E402
+from sql_app.models import Dish  # noqa: E402
+
+NAMES = ("宫保鸡丁", "鱼香肉丝", "麻婆豆腐", "红烧牛肉", "糖醋排骨", "清蒸鱼块", "干煸豆角", "酸菜鱼", "黄焖鸡", "土豆丝")
+
+
+def expected(prefix: str, k: int) -> list[str]:
+    weights: dict[str, float] = {}
+    for name, weight in suggest._dishes.values():
+        weights[name] = weights.get(name, 0.0) + weight
+    found = [(w, name) for name, w in weights.items() if any(key.startswith(prefix) for key in suggest._keys(name))]
+    return [name for _, name in sorted(found, key=lambda x: (-x[0], x[1]))[:k]]
+
+
+def check(rng: random.Random, samples: int) -> None:
+    names = {name for name, _ in suggest._dishes.values()} | set(NAMES)
+    for _ in range(samples):
+        key = rng.choice(sorted(suggest._keys(rng.choice(sorted(names)))))
+        prefix = key[: rng.randint(1, len(key))]
+        got, want = suggest.suggest(prefix, suggest.TOP_K), expected(prefix, suggest.TOP_K)
+        assert got == want, f"{prefix!r}: {got} != {want}"
+
+
+def run(dishes: int, changes: int, seed: int) -> None:
+    rng = random.Random(seed)
+
+    def dish(dish_id: int) -> Dish:
+        name = rng.choice(NAMES) + (str(rng.randint(1, 30)) if rng.random() < 0.5 else "")
+        return Dish(id=dish_id, name=name, count_of_mark=rng.randint(0, 50), count_of_votes=rng.randint(0, 50))
+
+    for dish_id in range(1, dishes + 1):
+        suggest.add(dish(dish_id))
+    check(rng, 200)
+    for _ in range(changes):
+        dish_id = rng.choice(list(suggest._dishes))
+        if rng.random() < 0.5:
+            suggest.remove(dish_id)  # DELETE /dish/{id}, retired by an upsert import
+        else:
+            suggest.add(dish(dish_id))  # renamed by PUT /dish
+        check(rng, 5)
+    # the last dishes of a name, and all the dishes
+    for name in NAMES[:3]:
+        suggest.remove(*[i for i, (n, _) in suggest._dishes.items() if n == name])
+    check(rng, 200)
+    print(f"consistent after {dishes} additions and {changes} changes")
+
+    prefixes = [key[:n] for name in NAMES for key in suggest._keys(name) for n in range(1, len(key) + 1)]
+    start = time.perf_counter()
+    for _ in range(100):
+        for prefix in prefixes:
+            suggest.suggest(prefix)
+    elapsed = time.perf_counter() - start
+    print(f"suggest: {elapsed / (100 * len(prefixes)) * 1e6:.2f} us per call")
+    suggest.remove(*list(suggest._dishes))
+    assert not suggest._weights and not suggest._root.top, "the trie is not empty"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dishes", type=int, default=2000)
+    parser.add_argument("--changes", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if suggest.lazy_pinyin is None:
+        sys.exit("pypinyin is not installed: pip install pypinyin (the `pinyin` extra)")
+    run(args.dishes, args.changes, args.seed)
@@ -0,0 +1,112 @@
+"""
+Concurrent uploads to /static/upload/ against the MinIO stand-in of bench/fake_s3.py, served on a local port.
+
+It checks that the files arrive whole and in parts of UPLOAD_PART_SIZE, that too large, unknown
+and mislabelled files are refused, and prints the throughput and the peak of the memory allocated
+by the process (tracemalloc) while the uploads run: it grows with the part size and the concurrency,
+not with the size of the files.
+
+    python bench/upload.py --uploads 16 --concurrency 8 --size-mb 8
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+_root = tempfile.mkdtemp(prefix="fake-s3-")
+_sock = socket.socket()
+_sock.bind(("127.0.0.1", 0))
+os.environ["MINIO_ENDPOINT"] = f"127.0.0.1:{_sock.getsockname()[1]}"
+# keep the import of sql_app away from the real database
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_root}/upload.db")
+# room for --size-mb, the limit itself is checked with a file one byte too large
+os.environ.setdefault("UPLOAD_MAX_SIZE", str(64 * 1024 * 1024))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import main  # noqa: E402
+from fake_s3 import create_app  # noqa: E402
+from obj_storage.client import bucket_name, minio_client  # noqa: E402
+from obj_storage.router import MAX_UPLOAD_SIZE  # noqa: E402
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 12
+
+
+def serve_fake_s3() -> tuple[uvicorn.Server, dict]:
+    os.makedirs(os.path.join(_root, bucket_name), exist_ok=True)
+    app = create_app(_root)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [_sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, app.state.fake
+
+
+async def upload(client: httpx.AsyncClient, name: str, data, content_type: str) -> httpx.Response:
+    return await client.post("/static/upload/", files={"file": (name, data, content_type)})
+
+
+async def run(uploads: int, concurrency: int, size: int) -> None:
+    server, stats = serve_fake_s3()
+    # sent from a file, so that the client does not hold the uploads in memory either
+    payload = JPEG + os.urandom(size - len(JPEG))
+    digest = hashlib.md5(payload).hexdigest()
+    photo = Path(_root) / "photo.jpg"
+    photo.write_bytes(payload)
+    del payload
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            refused = {
+                "too large": await upload(client, "big.jpg", JPEG + bytes(MAX_UPLOAD_SIZE + 1), "image/jpeg"),
+                "not an image": await upload(client, "a.txt", b"hello", "text/plain"),
+                "mislabelled": await upload(client, "a.png", JPEG, "image/png"),
+            }
+            for case, r in refused.items():
+                print(f"{case:>14}: {r.status_code}")
+
+            semaphore = asyncio.Semaphore(concurrency)
+            names: list[str] = []
+
+            async def one(i: int):
+                async with semaphore:
+                    with open(photo, "rb") as f:
+                        r = await upload(client, f"photo-{i}.jpg", f, "image/jpeg")
+                    r.raise_for_status()
+                    names.append(r.json()["object_name"])
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(uploads)))
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    whole = sum(hashlib.md5(minio_client.get_object(bucket_name, n).read()).hexdigest() == digest for n in names)
+    server.should_exit = True
+    mib = 1024 * 1024
+    print(f"{'uploads':>14}: {uploads} x {size / mib:.1f} MiB, {concurrency} at a time")
+    print(f"{'intact':>14}: {whole}/{uploads}")
+    print(f"{'store':>14}: {stats['single_puts']} single puts, {stats['multipart_uploads']} multipart uploads, {stats['parts']} parts")
+    print(f"{'throughput':>14}: {uploads * size / mib / elapsed:.1f} MiB/s")
+    print(f"{'peak memory':>14}: {peak / mib:.1f} MiB allocated ({concurrency * size / mib:.0f} MiB of files in flight)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+    asyncio.run(run(args.uploads, args.concurrency, int(args.size_mb * 1024 * 1024)))
@@ -1,80 +1,83 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from fastapi import HTTPException
 
 from sql_app.crud import canteen
 from sql_app.schemas import CanteenItem, CanteenBase, FloorData, FloorStored
-from sql_app import get_db
+from sql_app import get_read_session, get_session, versions
+from sql_app.crud import aio
 from users import check_admin_privilege
+import conditional
 
 router = APIRouter()
 
 
 @router.get("/all", response_model=list[CanteenItem])
-def get_all_canteen(db=Depends(get_db)):
-    return canteen.get_all(db)
+async def get_all_canteen(request: Request, response: Response, db=Depends(get_read_session)):
+    conditional.check(request, response, await aio.run(db, versions.etag, ("canteens",)))
+    return await aio.run(db, canteen.get_all)
 
 
 @router.get(
     "/campus/{campus_name}",
 )
-def get_canteen_by_campus(campus_name: str, db=Depends(get_db)):
-    return canteen.get_by_campus(db, campus_name)
+async def get_canteen_by_campus(campus_name: str, db=Depends(get_read_session)):
+    return await aio.run(db, canteen.get_by_campus, campus_name)
 
 
 @router.get("/search/{name}", response_model=list[CanteenItem])
-def search_canteen(name: str, db=Depends(get_db)):
-    return canteen.search(db, name)
+async def search_canteen(name: str, db=Depends(get_read_session)):
+    return await aio.run(db, canteen.search, name)
 
 
 @router.post("", response_model=CanteenItem)
-def add_canteen(
-    data: CanteenBase, db=Depends(get_db), privilege=Depends(check_admin_privilege)
+async def add_canteen(
+    data: CanteenBase, db=Depends(get_session), privilege=Depends(check_admin_privilege)
 ):
-    return canteen.add(db, data)
+    return await aio.run(db, canteen.add, data)
 
 
 @router.get("/{canteen_id}", response_model=CanteenItem)
-def get_canteen(canteen_id: int, db=Depends(get_db)):
-    return canteen.get_info(db, canteen_id)
+async def get_canteen(canteen_id: int, db=Depends(get_read_session)):
+    return await aio.run(db, canteen.get_info, canteen_id)
 
 
 @router.get("/{canteen_id}/floors", response_model=list[FloorStored])
-def get_floors(canteen_id: int, db=Depends(get_db)):
-    return canteen.get_floors_info(db, canteen_id)
+async def get_floors(canteen_id: int, db=Depends(get_read_session)):
+    return await aio.run(db, canteen.get_floors_info, canteen_id)
 
 
 @router.post("/{canteen_id}/floors", response_model=FloorStored)
-def add_floor(
+async def add_floor(
     canteen_id: int,
     data: FloorData,
-    db=Depends(get_db),
+    db=Depends(get_session),
     privilege=Depends(check_admin_privilege),
 ):
-    return canteen.add_floor(db, floor=data)
+    return await aio.run(db, canteen.add_floor, floor=data)
 
 
 @router.delete("/{canteen_id}", response_model=dict[str, str])
-def delete_canteen(
-    canteen_id: int, db=Depends(get_db), privilege=Depends(check_admin_privilege)
+async def delete_canteen(
+    canteen_id: int, db=Depends(get_session), privilege=Depends(check_admin_privilege)
 ):
-    return canteen.delete(db, canteen_id)
+    return await aio.run(db, canteen.delete, canteen_id)
 
 
 @router.put("/{canteen_id}/floors", response_model=dict[str, str])
-def update_floor(
+async def update_floor(
     canteen_id: int,
     data: FloorData,
-    db=Depends(get_db),
+    db=Depends(get_session),
     privilege=Depends(check_admin_privilege),
 ):
-    return canteen.update_floor_info(db, data)
+    return await aio.run(db, canteen.update_floor_info, data)
 
 
 @router.put("", response_model=dict[str, str])
-def update_canteen(
-    data: CanteenItem, db=Depends(get_db), privilege=Depends(check_admin_privilege)
+async def update_canteen(
+    data: CanteenItem, db=Depends(get_session), privilege=Depends(check_admin_privilege)
 ):
     try:
-        return canteen.update(db, data)
+        return await aio.run(db, canteen.update, data)
     except:
         raise HTTPException(status_code=400, detail="Invalid canteen id")
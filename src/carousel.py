@@ -1,20 +1,23 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from sql_app.crud import carousel 
-from sql_app import get_db
+from sql_app import get_read_session, get_session, versions
+from sql_app.crud import aio
 from users import check_admin_privilege
+import conditional
 router = APIRouter()
 
 @router.post('')
-def add_carousel(item: carousel.CarouselItem, db = Depends(get_db), privilege = Depends(check_admin_privilege)
+async def add_carousel(item: carousel.CarouselItem, db = Depends(get_session), privilege = Depends(check_admin_privilege)
                  ):
-    return carousel.add(db, item)
+    return await aio.run(db, carousel.add, item)
 
 @router.get('/{canteen}')
-def get_carousel(canteen: int, db = Depends(get_db), ):
-    return carousel.get(db, canteen)
+async def get_carousel(canteen: int, request: Request, response: Response, db = Depends(get_read_session), ):
+    conditional.check(request, response, await aio.run(db, versions.etag, ("carousels", canteen)))
+    return await aio.run(db, carousel.get, canteen)
 
 @router.delete('/{cid}')
-def delete_carousel(cid: int, db = Depends(get_db), privilege = Depends(check_admin_privilege)
+async def delete_carousel(cid: int, db = Depends(get_session), privilege = Depends(check_admin_privilege)
                     ):
-    return carousel.delete(db, cid)
+    return await aio.run(db, carousel.delete, cid)
 
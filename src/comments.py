@@ -2,53 +2,70 @@
 This file contains the API endpoints for comments. They are used to give rates and comments to dishes.
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sql_app.crud.comment import *
 from sql_app.crud.dishes import get_by_id as check_dish
 from sql_app.models import Comment
-from users import get_current_user, User
-from sql_app import get_db
+from users import check_admin_privilege, get_current_user, User
+from sql_app import get_read_session, get_session
+from sql_app.crud import aio, batch
+from sql_app.schemas import BatchQuery, BatchResult, CommentStored
+from sql_app.pagination import with_cursor
 router = APIRouter()
 
 @router.get("/{comment_id}")
-def read_comment(comment_id: int, db: Session = Depends(get_db)):
-    db_comment: Comment | None = get_comment(db, comment_id)
+async def read_comment(comment_id: int, db = Depends(get_read_session)):
+    db_comment: Comment | None = await aio.run(db, get_comment, comment_id)
     if db_comment is None:
         raise HTTPException(status_code=404, detail="Comment not found")
     return db_comment
 
+@router.post("/batch", response_model=BatchResult[CommentStored])
+async def read_comments_by_ids(query: BatchQuery, db = Depends(get_read_session)):
+    return await aio.run(db, batch.get_many, Comment, query.ids)
+
 @router.post("/")
-def create_comment(comment: CommentItem, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def create_comment(comment: CommentItem, db = Depends(get_session), user: User = Depends(get_current_user)):
     if comment.user_id != user.id and not user.is_admin:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    if not check_dish(db, comment.dish_id):
+    if not await aio.run(db, check_dish, comment.dish_id):
         raise HTTPException(status_code=404, detail="Dish not found")
     # update the vote of the dish
     
-    return post_comment(db, comment)
+    return await aio.run(db, post_comment, comment)
 
 @router.delete("/{comment_id}")
-def delete_comment(comment_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    db_comment = get_comment(db, comment_id)
+async def delete_comment(comment_id: int, db = Depends(get_session), user: User = Depends(get_current_user)):
+    db_comment = await aio.run(db, get_comment, comment_id)
     # if db_comment is None:
     #     raise HTTPException(status_code=404, detail="Comment not found")
     if not user.is_admin and user.id != db_comment.user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    if delete(db=db, comment_id=comment_id):
+    if await aio.run(db, delete, comment_id=comment_id):
         return {"message": "Comment deleted successfully"}
     else:
         raise HTTPException(status_code=404, detail="Comment not found")
 
 @router.put("/{comment_id}")
-def update_comment(comment_id: int, comment: CommentItem, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    db_comment = get_comment(db, comment_id)
+async def update_comment(comment_id: int, comment: CommentItem, db = Depends(get_session), user: User = Depends(get_current_user)):
+    db_comment = await aio.run(db, get_comment, comment_id)
     if db_comment is None:
         raise HTTPException(status_code=404, detail="Comment not found")
     if not user.is_admin and user.id != db_comment.user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    return update(db=db, comment_id=comment_id, comment=comment)
+    return await aio.run(db, update, comment_id=comment_id, comment=comment)
+
+@router.post("/ratings/reconcile")
+async def reconcile_dish_ratings(db = Depends(get_session), privileged = Depends(check_admin_privilege)) -> dict[str, int]:
+    """
+    Rebuild the average votes and the vote and comment counts of all the dishes from the comments.
+    """
+    return {"dishes": await aio.run(db, reconcile_ratings)}
 
 @router.get("/dish/{dish_id}")
-def read_comment_by_dish(dish_id: int, db: Session = Depends(get_db), skip: int = 0, limit: int = 100):
-    return get_comment_by_dish(db, dish_id, skip, limit)
+async def read_comment_by_dish(response: Response, dish_id: int, db = Depends(get_read_session), skip: int = 0, limit: int = Query(100, ge=1), cursor: str | None = None):
+    """
+    The next page, if any, is given by the cursor in the X-Next-Cursor header.
+    """
+    return with_cursor(response, await aio.run(db, get_comment_by_dish, dish_id, skip, limit, cursor=cursor))
 
@@ -0,0 +1,56 @@
+"""
+Conditional GET of the lists polled by the clients.
+
+A route reads the ETag of its list from sql_app.versions before reading it, and calls `check`:
+if the client sent the tag in If-None-Match, NotModified is raised and answered with an empty 304,
+without running the query of the list nor serializing it. Otherwise the tag is set on the response.
+
+`Cache-Control: no-cache` lets the clients keep the list but revalidate it on every use.
+"""
+
+import datetime
+import email.utils
+
+from fastapi import Request, Response
+
+CACHE_CONTROL = "no-cache"
+
+
+class NotModified(Exception):
+    def __init__(self, tag: str):
+        self.tag = tag
+
+
+def _matches(header: str, tag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(t.strip().removeprefix("W/") == tag for t in header.split(","))
+
+
+def fresh(request: Request, tag: str, last_modified: datetime.datetime | None = None) -> bool:
+    """
+    Whether the copy of the client is current, from If-None-Match or else If-Modified-Since.
+    """
+    header = request.headers.get("if-none-match")
+    if header:
+        return _matches(header, tag)
+    since = request.headers.get("if-modified-since")
+    if not since or last_modified is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates are in seconds
+    return since.tzinfo is not None and last_modified.replace(microsecond=0) <= since
+
+
+def check(request: Request, response: Response, tag: str) -> None:
+    """
+    Raise NotModified if the client has the current version of the response, else tag the response.
+    """
+    if fresh(request, tag):
+        raise NotModified(tag)
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = CACHE_CONTROL
@@ -1,113 +1,169 @@
 from sql_app.crud.dishes import *
 from sql_app.models import Dish
-from sql_app.schemas import DishItem, DishBase, PricingData, DishItemUpdate, AdvancedSearch
-from sql_app import get_db
+from sql_app.schemas import DishItem, DishBase, PricingData, DishItemUpdate, AdvancedSearch, ExcelImportResult, BatchQuery, BatchResult
+from sql_app import get_read_session, get_session, sampling, suggest, versions
+from sql_app.pagination import with_cursor
+from sql_app.crud import aio, batch
 from sql_app.crud.canteen import get_all
-from fastapi import APIRouter, Depends, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
-import random
-import pandas as pd
+import time
+from typing import Literal
+from menu_import import read_sheet, validate_rows
 from users import check_admin_privilege
+import conditional
+import fast_json
 
 router = APIRouter()
 
 @router.get("/search/", response_model=list[DishItem])
-def search_dish_by_name_alike(
-    s: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+async def search_dish_by_name_alike(
+    s: str, response: Response, skip: int = 0, limit: int = 100, db = Depends(get_read_session)
 ) -> list[Dish]:
-    return search(db, s, skip=skip, limit=limit)
+    return fast_json.respond(response, DishItem, await aio.run(db, search, s, skip=skip, limit=limit))
 
 @router.post("/search/advanced", response_model=list[DishItem])
-def advanced_search_dish(
-    data: AdvancedSearch = Depends(), db: Session = Depends(get_db)
+async def advanced_search_dish(
+    response: Response, data: AdvancedSearch = Depends(), db = Depends(get_read_session)
 ) -> list[Dish]:
-    return advanced_search(db, data)
+    """
+    The next page, if any, is given by the cursor in the X-Next-Cursor header.
+    """
+    page = with_cursor(response, await aio.run(db, advanced_search, data))
+    return fast_json.respond(response, DishItem, page)
+
+
+@router.post("/batch", response_model=BatchResult[DishItem])
+async def get_dishes_by_ids(query: BatchQuery, db = Depends(get_read_session)):
+    """
+    The dishes of a list of ids in one request, e.g. to show the marks of a user.
+    """
+    return await aio.run(db, batch.get_many, Dish, query.ids)
+
+
+@router.get("/suggest", response_model=list[str])
+async def suggest_dish_names(q: str, k: int = Query(10, ge=1, le=suggest.TOP_K), db = Depends(get_read_session)) -> list[str]:
+    """
+    Autocomplete dish names from their beginning, pinyin or initials, the most popular first.
+
+    Answered from memory, the database is only read once to build the index.
+    """
+    if not suggest.built:
+        await aio.run(db, suggest.build)
+    return suggest.suggest(q, k)
 
 
 @router.get("/excel/sample", response_class=FileResponse)
-def get_excel_sample(
+async def get_excel_sample(
     privileged = Depends(check_admin_privilege)
 ) -> FileResponse:
     return FileResponse("sample.xlsx")
 
 
-@router.post("/excel", response_model=list[DishItem])
-def upload_excel(file: UploadFile, db: Session = Depends(get_db), privileged = Depends(check_admin_privilege)
-                 ) -> list[Dish]:
+@router.post("/excel", response_model=ExcelImportResult)
+async def upload_excel(file: UploadFile,
+                 partial: bool = False,
+                 mode: Literal["append", "upsert"] = "append",
+                 retire_missing: bool = False,
+                 dry_run: bool = False,
+                 db = Depends(get_session),
+                 privileged = Depends(check_admin_privilege)
+                 ) -> ExcelImportResult:
+    """
+    Import the dishes in an Excel sheet. See GET /dish/excel/sample for the format.
+
+    The whole sheet is validated first and the errors are reported per row.
+    Unless `partial` is set, nothing is imported if any row is invalid.
+
+    - `append`: every row is added as a new dish
+    - `upsert`: rows are matched with the existing dishes on (canteen, floor, window, name).
+      Only new dishes are added and only changed prices and measures are updated.
+      With `retire_missing`, the dishes of the canteens in the sheet which are not in the sheet are deleted.
+      It cannot be combined with `partial`.
+
+    With `dry_run`, the sheet is checked (and diffed in upsert mode) but nothing is written.
+    """
+    if partial and retire_missing:
+        # the dishes of the rows skipped as invalid would be retired as missing from the sheet
+        raise HTTPException(400, detail="partial and retire_missing cannot be used together")
+    start = time.perf_counter()
     try:
-        df = pd.read_excel(file.file)
-    except:
+        df = await run_in_threadpool(read_sheet, file.file)
+    except ValueError:
         raise HTTPException(400, detail="Invalid Excel File")
-    data_dict = df.to_dict("records")
-    canteen_dict = {i.name: i.id for i in get_all(db)}
-    # print(canteen_dict)
-    ret:list[Dish] = []
-    for dicts in data_dict:
-        dish_item: DishBase=DishBase(
-                canteen=canteen_dict[dicts["食堂"]],
-                floor=dicts["楼层"],
-                window=dicts["窗口"],
-                name=dicts["菜品"],
-                measure=dicts["单位"],
-                price=dicts["价格"],
-            )
-        
-        ret.append(add_dish(
-            dish_item,
-            db,
-        ))
-
-    return ret
+    canteen_dict = {i.name: i.id for i in await aio.run(db, get_all)}
+    items, errors = await run_in_threadpool(validate_rows, df, canteen_dict)
+    diff = None
+    ret = []
+    if partial or not errors:
+        if mode == "upsert":
+            diff, ret = await aio.run(db, upsert_many, items, retire_missing=retire_missing, dry_run=dry_run)
+        elif not dry_run:
+            ret = await aio.run(db, add_many, items)
+    imported = len(ret) + len(diff.updated) if diff and not dry_run else len(ret)
+    elapsed = time.perf_counter() - start
+    return ExcelImportResult(
+        imported=imported,
+        dishes=[DishItem.model_validate(i, from_attributes=True) for i in ret],
+        errors=errors,
+        elapsed=elapsed,
+        rows_per_second=imported / elapsed if elapsed else 0.0,
+        diff=diff,
+    )
 
 @router.get("/{canteen}/all", response_model=list[DishItem])
-def get_dish_by_canteen(canteen: int, db: Session = Depends(get_db)) -> list[Dish]:
-    return get_all_by_canteen(db, canteen)
+async def get_dish_by_canteen(canteen: int, request: Request, response: Response, db = Depends(get_read_session)) -> list[Dish]:
+    conditional.check(request, response, await aio.run(db, versions.etag, ("dishes", canteen)))
+    return fast_json.respond(response, DishItem, await aio.run(db, get_all_by_canteen, canteen))
 
 
 @router.get("/{canteen}/{floor}/all", response_model=list[DishItem])
-def get_dish_by_floor(
-    canteen: int, floor: int, db: Session = Depends(get_db)
+async def get_dish_by_floor(
+    canteen: int, floor: int, request: Request, response: Response, db = Depends(get_read_session)
 ) -> list[Dish]:
-    return get_all_by_canteen(db, canteen, floor)
+    conditional.check(request, response, await aio.run(db, versions.etag, ("dishes", canteen)))
+    return fast_json.respond(response, DishItem, await aio.run(db, get_all_by_canteen, canteen, floor))
 
 
 @router.get("/{canteen}/{floor}/{window}", response_model=list[DishItem])
-def get_dish_by_window(
-    canteen: int, floor: int, window: int, db: Session = Depends(get_db)
+async def get_dish_by_window(
+    canteen: int, floor: int, window: int, request: Request, response: Response, db = Depends(get_read_session)
 ) -> list[Dish]:
-    return get_all_by_canteen(db, canteen, floor, window)
+    conditional.check(request, response, await aio.run(db, versions.etag, ("dishes", canteen)))
+    return fast_json.respond(response, DishItem, await aio.run(db, get_all_by_canteen, canteen, floor, window))
 
 
 @router.post("", response_model=DishBase)
-def add_dish(dish: DishBase, 
-             db: Session = Depends(get_db),
+async def add_dish(dish: DishBase, 
+             db = Depends(get_session),
              privileged = Depends(check_admin_privilege),
              ) -> Dish:
-    return add(db, dish)
+    return await aio.run(db, add, dish)
 
 
 @router.put("", response_model=DishItem)
-def update_dish(dish: DishItemUpdate, db: Session = Depends(get_db), privileged = Depends(check_admin_privilege)) -> Dish:
-    return update(db, dish)
+async def update_dish(dish: DishItemUpdate, db = Depends(get_session), privileged = Depends(check_admin_privilege)) -> Dish:
+    return await aio.run(db, update, dish)
 
 
 @router.patch("/{dish_id}/pricing", response_model=DishItem)
-def update_dish_pricing(
-    dish_id: int, pricing: PricingData, db: Session = Depends(get_db), privileged = Depends(check_admin_privilege)
+async def update_dish_pricing(
+    dish_id: int, pricing: PricingData, db = Depends(get_session), privileged = Depends(check_admin_privilege)
 ) -> Dish:
-    return update_price(db, dish_id, pricing)
+    return await aio.run(db, update_price, dish_id, pricing)
 
 
 @router.patch("/{dish_id}/image", response_model=DishItem)
-def update_dish_image(
-    dish_id: int, image_url: str, db: Session = Depends(get_db), privileged = Depends(check_admin_privilege)
+async def update_dish_image(
+    dish_id: int, image_url: str, db = Depends(get_session), privileged = Depends(check_admin_privilege)
 ) -> Dish:
     # check if valid image
-    return update_image(db, dish_id, image_url)
+    return await aio.run(db, update_image, dish_id, image_url)
 
 
 @router.delete("", deprecated=True)
-def delete_dish(dish: DishBase, db: Session = Depends(get_db), privileged = Depends(check_admin_privilege)
+async def delete_dish(dish: DishBase, db = Depends(get_session), privileged = Depends(check_admin_privilege)
                 ) -> dict[str, str]:
     """
     It is a stupid API which filters the dish by name and canteen and floor and other info but JUST NO ID
@@ -117,37 +173,43 @@ def delete_dish(dish: DishBase, db: Session = Depends(get_db), privileged = Depe
     **To be deprecated** as the function consumes too much time while filtering the dish by all the info simply to get the id
     """
     try:
-        id = get_all_by_canteen(db, dish.canteen, dish.floor, dish.window, dish.name)
+        id = await aio.run(db, get_all_by_canteen, dish.canteen, dish.floor, dish.window, dish.name)
         assert len(id) == 1
         id = id[0].id
-        return delete(db, id)
+        return await aio.run(db, delete, id)
     except:
         raise HTTPException(422, detail="No such dish")
 
 
 @router.delete("/{dish_id}")
-def delete_dish_by_id(dish_id: int, db: Session = Depends(get_db), privileged = Depends(check_admin_privilege)
+async def delete_dish_by_id(dish_id: int, db = Depends(get_session), privileged = Depends(check_admin_privilege)
                       ) -> dict[str, str]:
     try:
-        return delete(db, dish_id)
+        return await aio.run(db, delete, dish_id)
     except:
         raise HTTPException(422, detail="No such dish")
 
 
 @router.get("/{dish_id}", response_model=DishItem)
-def get_dish_by_id(dish_id: int, db: Session = Depends(get_db)) -> Dish:
-    ret = get_by_id(db, dish_id)
+async def get_dish_by_id(dish_id: int, db = Depends(get_read_session)) -> Dish:
+    ret = await aio.run(db, get_by_id, dish_id)
     if ret is None:
         raise HTTPException(404, detail="Dish Not found")
     return ret
 
 
 @router.get("/{canteen}/random", response_model=DishItem)
-def get_random_dish(canteen: int, db: Session = Depends(get_db)) -> Dish:
-    try:
-        return random.choice(get_all_by_canteen(db, canteen))
-    except:
-        raise HTTPException(422, detail="Invalid input")
-
-
+async def get_random_dish(canteen: int,
+                    floor: int = 0,
+                    window: int = 0,
+                    weighting: sampling.Weighting = "uniform",
+                    db = Depends(get_read_session)) -> Dish:
+    """
+    Get a random dish of a canteen, optionally of a floor and a window.
 
+    The draw is uniform, or weighted by `average_vote` or `count_of_mark`.
+    """
+    ret = await aio.run(db, get_random, canteen, floor, window, weighting)
+    if ret is None:
+        raise HTTPException(422, detail="Invalid input")
+    return ret
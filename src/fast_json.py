@@ -0,0 +1,59 @@
+"""
+Faster serialization of the long lists of rows, enabled with FAST_JSON=1.
+
+FastAPI validates what a route returns against its response_model, dumps the models to Python objects
+and encodes them with the json module: for a list of 200 dishes, most of the CPU time of the request.
+`respond` reads the fields of the response model straight from the rows and encodes them with orjson
+into a Response, which FastAPI sends as is.
+
+The JSON is the same as FastAPI's: decimals are strings, as pydantic writes them, and datetimes are
+in ISO format. The rows are not validated, so it is only meant for rows read from the database with
+the columns of the model.
+"""
+
+import decimal
+import functools
+import operator
+import os
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+ENABLED = os.getenv("FAST_JSON", "0") == "1"
+
+# not copied from the response of the route, they are set for the body
+_BODY_HEADERS = {"content-length", "content-type"}
+
+
+@functools.cache
+def _fields(model: type[BaseModel]) -> tuple[tuple[str, ...], operator.attrgetter]:
+    fields = tuple(model.model_fields)
+    return fields, operator.attrgetter(*fields)
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def dumps(model: type[BaseModel], rows) -> bytes:
+    """
+    The JSON list of the rows, ORM objects or result rows, as instances of the model.
+    """
+    fields, values = _fields(model)
+    return orjson.dumps([dict(zip(fields, values(row))) for row in rows], default=_default)
+
+
+def respond(response: Response, model: type[BaseModel], rows):
+    """
+    The response of a route returning a list of rows of the model.
+    Returns the rows themselves when the fast path is disabled, for FastAPI to serialize them.
+
+    :param response: the Response of the route, whose headers (cursor, ETag) are kept
+    """
+    if not ENABLED:
+        return rows
+    headers = {k: v for k, v in response.headers.items() if k not in _BODY_HEADERS}
+    return Response(dumps(model, rows), media_type="application/json", headers=headers)
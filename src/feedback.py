@@ -1,23 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sql_app.crud.feedback import *
-from sql_app import get_db
+from sql_app import get_read_session, get_session
+from sql_app.crud import aio
+from sql_app.pagination import with_cursor
 from users import get_current_user, User, check_admin_privilege
 router = APIRouter()
 
 @router.get("/user/{uid}")
-async def get_comments(uid: int, skip: int, limit: int, db=Depends(get_db), user: User=Depends(get_current_user)):
+async def get_comments(response: Response, uid: int, skip: int = 0, limit: int = Query(100, ge=1), cursor: str | None = None, db=Depends(get_read_session), user: User=Depends(get_current_user)):
     if user.id != uid or not user.is_admin:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    return get_by_user(
-        db=db,
+    return with_cursor(response, await aio.run(
+        db,
+        get_by_user,
         uid=uid,
         skip=skip,
-        limit=limit
-    )
+        limit=limit,
+        cursor=cursor
+    ))
 
 @router.get('{fid}')
-async def get_feedback(fid: int, db=Depends(get_db), p:User = Depends(get_current_user)):
-    res =  get_by_id(db, fid)
+async def get_feedback(fid: int, db=Depends(get_read_session), p:User = Depends(get_current_user)):
+    res = await aio.run(db, get_by_id, fid)
     if res is None:
         raise HTTPException(status_code=404, detail="Feedback not found")
     if res.user_id != p.id and not p.is_admin:
@@ -26,15 +30,15 @@ async def get_feedback(fid: int, db=Depends(get_db), p:User = Depends(get_curren
     return res
 
 @router.post('/')
-async def create_feedback(feedback: FeedbackCreate, db=Depends(get_db), user: User=Depends(get_current_user)):
+async def create_feedback(feedback: FeedbackCreate, db=Depends(get_session), user: User=Depends(get_current_user)):
     if user.id != feedback.user_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    return create(db, feedback)
+    return await aio.run(db, create, feedback)
 
 @router.put('/')
-async def update_feedback(feedback: FeedbackModify, db=Depends(get_db), user: User=Depends(get_current_user)):
+async def update_feedback(feedback: FeedbackModify, db=Depends(get_session), user: User=Depends(get_current_user)):
     try:
-        return modify_content(db, feedback, user.id)
+        return await aio.run(db, modify_content, feedback, user.id)
     except ValueError as e:
         raise HTTPException(status_code=403, detail=str(e))
     except AssertionError as e:
@@ -42,13 +46,13 @@ async def update_feedback(feedback: FeedbackModify, db=Depends(get_db), user: Us
     
 
 @router.put('/reply')
-async def reply_feedback(reply: FeedbackReplyCreate, db=Depends(get_db), user: User=Depends(get_current_user)):
+async def reply_feedback(reply: FeedbackReplyCreate, db=Depends(get_session), user: User=Depends(get_current_user)):
     if user.id != reply.user_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    return update_reply(db, reply)
+    return await aio.run(db, update_reply, reply)
 
 @router.get('/target/{tid}')
-async def get_target_feedback(tid: int, db=Depends(get_db), replied: bool | None= None, p = Depends(check_admin_privilege)):
-    return get_by_target(db, tid, replied)
+async def get_target_feedback(response: Response, tid: int, db=Depends(get_read_session), replied: bool | None= None, skip: int = 0, limit: int = Query(100, ge=1), cursor: str | None = None, p = Depends(check_admin_privilege)):
+    return with_cursor(response, await aio.run(db, get_by_target, tid, replied, skip, limit, cursor))
@@ -0,0 +1,144 @@
+"""
+Detection of callbacks blocking the event loop.
+
+A heartbeat task wakes up every `interval` seconds. When it wakes up later than
+LOOP_LAG_THRESHOLD_MS (default 100, 0 disables the monitor), the loop was blocked and the stall is logged.
+
+The heartbeat only knows about the stall once it is over, so a watchdog thread samples the
+blocked loop meanwhile: the request whose task is running (tracked by RequestTracker)
+and the stack of the loop thread. Both are attached to the log of the stall.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+logger = logging.getLogger("uvicorn.error")
+
+THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100")) / 1000
+STACK_DEPTH = 8
+
+# scope of the request each task is handling
+_requests: dict[asyncio.Task, dict] = {}
+_heartbeat = 0.0
+# (heartbeat, route, stack) sampled by the watchdog during the current stall
+_sample: tuple[float, str, list[str]] | None = None
+_task: asyncio.Task | None = None
+_thread: threading.Thread | None = None
+_stop = threading.Event()
+
+metrics = {"stalls": 0, "max_lag_ms": 0.0, "total_lag_ms": 0.0}
+stalls_by_route: Counter[str] = Counter()
+
+
+class RequestTracker:
+    """
+    ASGI middleware remembering which request each task is handling.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        task = asyncio.current_task()
+        _requests[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _requests.pop(task, None)
+
+
+def route_of(scope: dict | None) -> str:
+    """
+    The method and path template of the request, e.g. "GET /dish/{canteen}/all".
+    """
+    if scope is None:
+        return "<no request>"
+    # set by the router once the request is matched
+    route = scope.get("route")
+    regex = getattr(route, "path_regex", None)
+    if regex is None:
+        return f'{scope["method"]} {scope["path"]}'
+    # the route of an included router may only have the path after the prefix of the router:
+    # the prefix is what is before the part of the path matched by the route
+    path = scope["path"]
+    for i in [i for i, char in enumerate(path) if char == "/"] + [len(path)]:
+        if regex.fullmatch(path[i:]):
+            return f'{scope["method"]} {path[:i]}{route.path}'
+    return f'{scope["method"]} {route.path}'
+
+
+async def _beat(interval: float, threshold: float) -> None:
+    global _heartbeat
+    while True:
+        _heartbeat = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = time.monotonic() - _heartbeat - interval
+        if lag < threshold:
+            continue
+        sample = _sample if _sample and _sample[0] == _heartbeat else None
+        route, stack = (sample[1], sample[2]) if sample else ("<unknown>", [])
+        metrics["stalls"] += 1
+        metrics["total_lag_ms"] += lag * 1000
+        metrics["max_lag_ms"] = max(metrics["max_lag_ms"], lag * 1000)
+        stalls_by_route[route] += 1
+        logger.warning(
+            "Event loop blocked for %.0f ms while handling %s\n%s", lag * 1000, route, "".join(stack)
+        )
+
+
+def _watch(loop: asyncio.AbstractEventLoop, loop_thread: int, interval: float) -> None:
+    global _sample
+    while not _stop.wait(interval):
+        beat = _heartbeat
+        if time.monotonic() - beat < 2 * interval or (_sample and _sample[0] == beat):
+            continue
+        # the loop is blocked: whatever runs now is the culprit
+        task = asyncio.current_task(loop)
+        frame = sys._current_frames().get(loop_thread)
+        stack = traceback.format_stack(frame)[-STACK_DEPTH:] if frame else []
+        _sample = (beat, route_of(_requests.get(task)), stack)
+
+
+def start(threshold: float = THRESHOLD) -> None:
+    """
+    Start monitoring the running loop.
+    """
+    global _task, _thread
+    if threshold <= 0 or _task is not None:
+        return
+    interval = threshold / 4
+    _stop.clear()
+    _task = asyncio.create_task(_beat(interval, threshold))
+    _thread = threading.Thread(
+        target=_watch,
+        args=(asyncio.get_running_loop(), threading.get_ident(), interval),
+        name="loop-monitor",
+        daemon=True,
+    )
+    _thread.start()
+
+
+async def stop() -> None:
+    global _task, _thread
+    if _task is None:
+        return
+    _stop.set()
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _thread.join()
+    _task = _thread = None
+
+
+def stats() -> dict:
+    return {**metrics, "threshold_ms": THRESHOLD * 1000, "stalls_by_route": dict(stalls_by_route)}
@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 import dish
 import users
 import canteen
@@ -11,7 +12,81 @@ import feedback
 import uvicorn
 import comments
 import obj_storage
-app = FastAPI()
+import sdu_sso
+import loop_monitor
+import conditional
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from sql_app import SessionLocal, async_engine, cache, counters, suggest
+from sql_app.crud.comment import ensure_ratings
+from sql_app.pagination import NEXT_CURSOR_HEADER, InvalidCursor
+from obj_storage import variants
+from obj_storage.disk_cache import static_cache
+from users import check_admin_privilege
+
+
+def flush_counters():
+    with SessionLocal() as db:
+        counters.flush(db)
+
+
+async def flush_counters_periodically():
+    while True:
+        await asyncio.sleep(counters.FLUSH_INTERVAL)
+        try:
+            await run_in_threadpool(flush_counters)
+        except Exception as e:
+            # the deltas are kept for the next flush
+            print(f"Warning: failed to flush the counters: {e!r}")
+
+
+def rebuild_suggestions():
+    with SessionLocal() as db:
+        suggest.build(db)
+
+
+async def rebuild_suggestions_periodically():
+    # the popularity of the names only changes with a rebuild
+    while True:
+        await asyncio.sleep(suggest.REBUILD_INTERVAL)
+        try:
+            await run_in_threadpool(rebuild_suggestions)
+        except Exception as e:
+            # the current trie is kept until the next rebuild
+            print(f"Warning: failed to rebuild the suggestions: {e!r}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with SessionLocal() as db:
+        ensure_ratings(db)
+        suggest.build(db)
+    loop_monitor.start()
+    flusher = asyncio.create_task(flush_counters_periodically())
+    rebuilder = asyncio.create_task(rebuild_suggestions_periodically())
+    yield
+    rebuilder.cancel()
+    flusher.cancel()
+    await run_in_threadpool(flush_counters)
+    await loop_monitor.stop()
+    await sdu_sso.aclose()
+    variants.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(conditional.NotModified)
+async def not_modified_handler(request: Request, exc: conditional.NotModified):
+    return Response(status_code=304, headers={"ETag": exc.tag, "Cache-Control": conditional.CACHE_CONTROL})
 
 # add CORS
 
@@ -26,7 +101,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
+app.add_middleware(loop_monitor.RequestTracker)
 
 # app.mount("/pictures", StaticFiles(directory="pictures"), name="pictures")
 app.include_router(dish.router, prefix="/dish", tags=["dish"])
@@ -43,5 +120,20 @@ app.include_router(obj_storage.router, prefix="/static", tags=["storage"])
 def read_root():
     return {"Hello": "World"}
 
+
+@app.get("/metrics", tags=["metrics"])
+def read_metrics(privileged=Depends(check_admin_privilege)):
+    """
+    Counters of the in-process caches and subsystems.
+    """
+    return {
+        "caches": cache.stats(),
+        "sso": sdu_sso.stats(),
+        "event_loop": loop_monitor.stats(),
+        "counters": counters.stats(),
+        "static_cache": static_cache.stats(),
+        "image_variants": variants.stats(),
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app="main:app", host="127.0.0.1", port=8000, reload=True)
@@ -1,30 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 
 from sql_app.crud import marks
-from sql_app import get_db
-from users import get_current_user, User
+from sql_app import counters, get_read_session, get_session
+from sql_app.crud import aio
+from sql_app.pagination import with_cursor
+from sql_app.schemas import MarkedDish
+from users import check_admin_privilege, get_current_user, User
+import fast_json
 
 router = APIRouter()
 
 @router.post('')
-def add_mark(mark: marks.MarkCreate, db = Depends(get_db), user: User = Depends(get_current_user)):
+async def add_mark(mark: marks.MarkCreate, db = Depends(get_session), user: User = Depends(get_current_user)):
     if user.id != mark.user_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    return marks.add(db, mark)
+    return await aio.run(db, marks.add, mark)
+
+@router.post('/counts/reconcile')
+async def reconcile_mark_counts(db = Depends(get_session), privileged = Depends(check_admin_privilege)):
+    """
+    Count the marks of every dish again, e.g. after a crash lost the counts not written yet.
+    """
+    await aio.run(db, counters.reconcile)
+    return {"message": "Mark counts reconciled"}
 
 @router.get('/user/{uid}')
-def get_marks_by_user(uid: int, db = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_marks_by_user(response: Response, uid: int, skip: int = 0, limit: int = Query(100, ge=1), cursor: str | None = None, db = Depends(get_read_session), user: User = Depends(get_current_user)):
+    if user.id != uid:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return with_cursor(response, await aio.run(db, marks.get_by_user, uid, skip, limit, cursor))
+
+@router.get('/user/{uid}/dishes', response_model=list[MarkedDish])
+async def get_marked_dishes(response: Response, uid: int, skip: int = 0, limit: int = Query(100, ge=1), cursor: str | None = None, db = Depends(get_read_session), user: User = Depends(get_current_user)):
+    """
+    The dishes marked by the user, with their marks. The next page, if any, is given by the cursor in the X-Next-Cursor header.
+    """
     if user.id != uid:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    return marks.get_by_user(db, uid)
+    page = with_cursor(response, await aio.run(db, marks.get_dishes_by_user, uid, skip, limit, cursor))
+    return fast_json.respond(response, MarkedDish, page)
 
 @router.get('/dish/{did}/marked_by')
-def get_marks_by_dish(did: int, db = Depends(get_db)):
-    return marks.get_by_dish(db, did)
+async def get_marks_by_dish(did: int, db = Depends(get_read_session)) -> int:
+    """
+    The number of marks of the dish, counted.
+    """
+    return await aio.run(db, marks.get_by_dish, did)
+
+@router.get('/dish/{did}/count')
+async def count_marks_of_dish(did: int, db = Depends(get_read_session)) -> int:
+    """
+    The number of marks of the dish, read from the count maintained on the dish.
+    """
+    res = await aio.run(db, marks.count_by_dish, did)
+    if res is None:
+        raise HTTPException(status_code=404, detail="Dish not found")
+    return res
 
 @router.get('/{mid}')
-def get_mark(mid: int, db = Depends(get_db), user: User = Depends(get_current_user)):
-    res = marks.get_by_id(db, mid)
+async def get_mark(mid: int, db = Depends(get_read_session), user: User = Depends(get_current_user)):
+    res = await aio.run(db, marks.get_by_id, mid)
     if res is None:
         raise HTTPException(status_code=404, detail="Mark not found")
     if res.user_id != user.id:
@@ -32,9 +67,9 @@ def get_mark(mid: int, db = Depends(get_db), user: User = Depends(get_current_us
     return res
 
 @router.delete('/{mid}')
-def delete_mark(mid: int, db = Depends(get_db), user: User = Depends(get_current_user)):
+async def delete_mark(mid: int, db = Depends(get_session), user: User = Depends(get_current_user)):
     try:
-        res = marks.delete(db, mid, user.id)
+        res = await aio.run(db, marks.delete, mid, user.id)
     except ValueError as e:
         raise HTTPException(status_code=403, detail=str(e))
     if res is None:
@@ -0,0 +1,110 @@
+"""
+Parsing and validation of the Excel menu sheets uploaded through POST /dish/excel.
+
+The whole sheet is validated before anything touches the database, so that the
+admin gets every problem of the sheet at once instead of the first one only.
+"""
+
+from typing import IO, Any
+
+import pandas as pd
+from pydantic import ValidationError
+
+from sql_app.schemas import DishBase, ExcelRowError
+
+# column in the sheet -> field of DishBase
+COLUMNS = {
+    "食堂": "canteen",
+    "楼层": "floor",
+    "窗口": "window",
+    "菜品": "name",
+    "单位": "measure",
+    "价格": "price",
+}
+REQUIRED_COLUMNS = ("食堂", "楼层", "窗口", "菜品")
+FIELD_TO_COLUMN = {v: k for k, v in COLUMNS.items()}
+HEADER_ROWS = 1  # the first row of the sheet is the header
+
+
+def read_sheet(file: IO[bytes]) -> pd.DataFrame:
+    """
+    Read the first sheet of an Excel file. Raises ValueError on unreadable files.
+    """
+    try:
+        return pd.read_excel(file)
+    except Exception as e:
+        raise ValueError("Invalid Excel File") from e
+
+
+def _cell(value: Any) -> Any:
+    # pandas uses NaN for empty cells
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def validate_rows(
+    df: pd.DataFrame, canteen_ids: dict[str, int]
+) -> tuple[list[DishBase], list[ExcelRowError]]:
+    """
+    Validate every row of the sheet.
+
+    :param df: the sheet read by read_sheet
+    :param canteen_ids: canteen name -> canteen id
+    :return: the valid dishes and the errors of the invalid rows. Row numbers are the ones shown by Excel.
+        A row repeating the canteen, floor, window and name of an earlier row is an error.
+    """
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        return [], [
+            ExcelRowError(row=HEADER_ROWS, column=c, detail="Missing column")
+            for c in missing
+        ]
+
+    dishes: list[DishBase] = []
+    errors: list[ExcelRowError] = []
+    # natural key -> the row where it first appears
+    first_rows: dict[tuple, int] = {}
+    for i, record in enumerate(df.to_dict("records")):
+        row = i + HEADER_ROWS + 1
+        data = {
+            field: _cell(record.get(column)) for column, field in COLUMNS.items()
+        }
+        canteen_name = data["canteen"]
+        if canteen_name not in canteen_ids:
+            errors.append(
+                ExcelRowError(
+                    row=row, column="食堂", detail=f"Unknown canteen: {canteen_name}"
+                )
+            )
+            continue
+        data["canteen"] = canteen_ids[canteen_name]
+        if data["measure"] is None:
+            data.pop("measure")
+        try:
+            dish = DishBase(**data)
+        except ValidationError as e:
+            for err in e.errors():
+                field = str(err["loc"][0]) if err["loc"] else None
+                errors.append(
+                    ExcelRowError(
+                        row=row,
+                        column=FIELD_TO_COLUMN.get(field, field),
+                        detail=err["msg"],
+                    )
+                )
+            continue
+        key = (dish.canteen, dish.floor, dish.window, dish.name)
+        if key in first_rows:
+            errors.append(
+                ExcelRowError(
+                    row=row, column="菜品", detail=f"Duplicate of row {first_rows[key]}"
+                )
+            )
+            continue
+        first_rows[key] = row
+        dishes.append(dish)
+    return dishes, errors
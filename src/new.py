@@ -1,25 +1,30 @@
 from typing import List
-from fastapi import APIRouter, Depends, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sql_app.models import Dish
 from sql_app.crud import new_dish
 from sql_app.schemas import DishItem
-from sql_app import get_db
+from sql_app import get_read_session, get_session, versions
+from sql_app.crud import aio
 from users import check_admin_privilege
+import conditional
+import fast_json
 router = APIRouter()
 
 @router.post('', response_model=DishItem)
-def add_new_dish(id: int, db = Depends(get_db), privilege = Depends(check_admin_privilege)
+async def add_new_dish(id: int, db = Depends(get_session), privilege = Depends(check_admin_privilege)
                  ) -> new_dish.Dish | None:
-    if ret:= new_dish.add(db, id):
+    if ret:= await aio.run(db, new_dish.add, id):
         return ret
     else:
         raise HTTPException(status_code=404, detail="No such dish")
 
 @router.get('/{canteen}', response_model=List[DishItem])
-def get_new_dish(canteen: int, db = Depends(get_db)) -> List[Dish]:
-    return new_dish.get(db, canteen)
+async def get_new_dish(canteen: int, request: Request, response: Response, db = Depends(get_read_session)) -> List[Dish]:
+    # the new dishes are listed with their ratings and prices
+    conditional.check(request, response, await aio.run(db, versions.etag, ("new", canteen), ("dishes", canteen)))
+    return fast_json.respond(response, DishItem, await aio.run(db, new_dish.get, canteen))
 
 @router.delete('/{dish_id}')
-def delete_new_dish(dish_id:int, db = Depends(get_db), privilege = Depends(check_admin_privilege)
+async def delete_new_dish(dish_id:int, db = Depends(get_session), privilege = Depends(check_admin_privilege)
                     ):
-    return new_dish.delete(db,  dish_id=dish_id)
+    return await aio.run(db, new_dish.delete, dish_id=dish_id)
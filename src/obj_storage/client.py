@@ -2,7 +2,7 @@ import minio
 import os
 
 minio_client = minio.Minio(
-    'localhost:9000',
+    os.getenv('MINIO_ENDPOINT', 'localhost:9000'),
     access_key=os.getenv('MINIO_ACCESS_KEY'),
     secret_key=os.getenv('MINIO_SECRET'),
     secure=False
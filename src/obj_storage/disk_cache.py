@@ -0,0 +1,175 @@
+"""
+A size-bounded LRU cache of objects on the local disk, for the downloads of /static/get/.
+
+The carousel and dish images are fetched on every load of the home page: the first full download
+of an object is written to STATIC_CACHE_DIR while it is streamed to the client, and the next ones
+are read from there without any request to the object store. Objects larger than
+STATIC_CACHE_MAX_OBJECT are not cached.
+
+The objects are named by uuids and never rewritten, so an entry is not revalidated against the store.
+Code deleting or replacing an object calls `invalidate`. The cache is per process and starts empty:
+each worker keeps its files in a subdirectory of STATIC_CACHE_DIR named by its pid, and removes the
+subdirectories of the processes which are gone.
+"""
+
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+STATIC_CACHE_DIR = os.getenv("STATIC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "what-to-eat-static"))
+# 0 disables the cache
+STATIC_CACHE_SIZE = int(os.getenv("STATIC_CACHE_SIZE", str(256 * 1024 * 1024)))
+STATIC_CACHE_MAX_OBJECT = int(os.getenv("STATIC_CACHE_MAX_OBJECT", str(8 * 1024 * 1024)))
+
+
+def _remove_dead(directory: Path) -> None:
+    """
+    Remove the subdirectories of the processes which no longer run.
+    """
+    for path in directory.iterdir():
+        if not path.name.isdigit():
+            continue
+        try:
+            os.kill(int(path.name), 0)
+        except ProcessLookupError:
+            shutil.rmtree(path, ignore_errors=True)
+        except OSError:  # e.g. running as another user
+            pass
+
+
+class ObjectInfo(NamedTuple):
+    size: int
+    etag: str
+    last_modified: datetime.datetime
+    content_type: str
+
+
+class DiskLRU:
+    """
+    A thread safe mapping from object names to files in `directory`, of `max_bytes` in total.
+    When full, the least recently used objects are deleted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_object_size: int):
+        # the other workers evict their own files, which this one must not index nor delete
+        self.directory = Path(directory) / str(os.getpid())
+        self.max_bytes = max_bytes
+        self.max_object_size = min(max_object_size, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        # bumped by every invalidation, so that a download started before it is not cached after it
+        self.generation = 0
+        self._data: OrderedDict[str, ObjectInfo] = OrderedDict()
+        self._lock = threading.Lock()
+        if max_bytes > 0:
+            # the files of a previous process with the same pid are not indexed
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            _remove_dead(self.directory.parent)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{hashlib.sha1(name.encode()).hexdigest()}.obj"
+
+    def open(self, name: str) -> tuple[ObjectInfo, BinaryIO] | None:
+        """
+        The information of a cached object and its open file, None on a miss.
+        The file stays readable if the object is evicted meanwhile.
+        """
+        with self._lock:
+            info = self._data.get(name)
+            if info is None:
+                self.misses += 1
+                return None
+            try:
+                file = open(self._path(name), "rb")
+            except OSError:
+                # removed behind our back: forget it, the object is read from the store
+                del self._data[name]
+                self.bytes -= info.size
+                self.misses += 1
+                return None
+            self._data.move_to_end(name)
+            self.hits += 1
+            return info, file
+
+    def cacheable(self, info: ObjectInfo) -> bool:
+        return self.max_bytes > 0 and info.size <= self.max_object_size
+
+    def writer(self, name: str, info: ObjectInfo) -> "CacheWriter":
+        with self._lock:
+            return CacheWriter(self, name, info, self.generation)
+
+    def _commit(self, name: str, info: ObjectInfo, tmp: Path, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation or name in self._data:
+                tmp.unlink(missing_ok=True)
+                return
+            tmp.replace(self._path(name))
+            self._data[name] = info
+            self.bytes += info.size
+            while self.bytes > self.max_bytes:
+                old, old_info = self._data.popitem(last=False)
+                self._path(old).unlink(missing_ok=True)
+                self.bytes -= old_info.size
+                self.evictions += 1
+
+    def invalidate(self, *names: str) -> None:
+        with self._lock:
+            self.generation += 1
+            for name in names:
+                info = self._data.pop(name, None)
+                if info is not None:
+                    self._path(name).unlink(missing_ok=True)
+                    self.bytes -= info.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "objects": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class CacheWriter:
+    """
+    Writes the chunks of a download to a temporary file, which becomes the cached object if the download completes.
+    """
+
+    def __init__(self, cache: DiskLRU, name: str, info: ObjectInfo, generation: int):
+        self.cache = cache
+        self.name = name
+        self.info = info
+        self.generation = generation
+        fd, tmp = tempfile.mkstemp(suffix=".obj.part", dir=cache.directory)
+        self.tmp = Path(tmp)
+        self.file = os.fdopen(fd, "wb")
+        self.written = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+        self.written += len(chunk)
+
+    def close(self) -> None:
+        """
+        Cache the object if it was written whole, else drop it.
+        """
+        self.file.close()
+        if self.written == self.info.size:
+            self.cache._commit(self.name, self.info, self.tmp, self.generation)
+        else:
+            self.tmp.unlink(missing_ok=True)
+
+
+static_cache = DiskLRU(STATIC_CACHE_DIR, STATIC_CACHE_SIZE, STATIC_CACHE_MAX_OBJECT)
@@ -1,33 +1,339 @@
-from io import BytesIO
-from typing import Annotated
-from fastapi import APIRouter, File, UploadFile
+import email.utils
+import itertools
+import json
+import os
+import re
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
+from minio.error import S3Error
+from starlette.datastructures import UploadFile
 import uuid
 
+import conditional
+from sql_app import ReadSessionLocal, pagination
+from sql_app.crud import images
+from users import check_admin_privilege
+
 router = APIRouter()
 
 from .client import minio_client, bucket_name
+from .disk_cache import ObjectInfo, static_cache
+from . import variants
+
+# The largest file accepted by /upload/
+MAX_UPLOAD_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(10 * 1024 * 1024)))
+# The size of the parts of the multipart uploads to the store, 5 MiB at least.
+# Files up to this size are sent in a single request.
+PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(5 * 1024 * 1024)))
+# Room for the boundaries and headers of the multipart body around the file
+_FORM_OVERHEAD = 16 * 1024
+# Cache-Control of the downloads, revalidated with their ETag once stale
+STATIC_CACHE_CONTROL = f"public, max-age={int(os.getenv('STATIC_MAX_AGE', '86400'))}"
+_CHUNK_SIZE = 64 * 1024
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+# The objects of a page of /list, and of a lookup of the orphan scan
+MAX_LIST = 1000
+NDJSON = "application/x-ndjson"
+
+# The accepted types of files, by their first bytes
+_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"GIF87a": "image/gif",
+    b"GIF89a": "image/gif",
+}
+CONTENT_TYPES = {*_SIGNATURES.values(), "image/webp"}
+
+
+def sniff(head: bytes) -> str | None:
+    """
+    The type of a file from its first 12 bytes, None if it is not an accepted type.
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return next((t for signature, t in _SIGNATURES.items() if head.startswith(signature)), None)
+
+# The minio client is blocking: its calls run in the threadpool so that they do not stall the event loop.
+
+def _line(item: dict) -> bytes:
+    return json.dumps(item, ensure_ascii=False).encode() + b"\n"
+
+
+def _describe(obj) -> dict:
+    return {
+        "name": obj.object_name,
+        "size": obj.size,
+        "etag": obj.etag,
+        "last_modified": obj.last_modified.isoformat() if obj.last_modified else None,
+    }
+
+
+async def _listing(prefix: str, start_after: str | None = None):
+    """
+    The objects in the order of their names, fetched by pages while iterating.
+    The first page is fetched here, so that an error of the store is answered before the body starts.
+    """
+    objects = minio_client.list_objects(bucket_name, prefix=prefix or None, recursive=True, start_after=start_after)
+    first = await run_in_threadpool(next, objects, None)
+    return itertools.chain([first], objects) if first is not None else iter(())
+
+
+def _page_lines(objects, limit: int):
+    last = None
+    for obj in itertools.islice(objects, limit):
+        last = obj.object_name
+        yield _line(_describe(obj))
+    if last is not None and next(objects, None) is not None:
+        yield _line({"next_cursor": pagination.encode({"a": last})})
+
+
+def _orphan_lines(objects):
+    while page := list(itertools.islice(objects, MAX_LIST)):
+        originals = {variants.original_name(obj.object_name) for obj in page}
+        with ReadSessionLocal() as db:
+            used = images.referenced(db, originals | {obj.object_name for obj in page})
+        for obj in page:
+            if obj.object_name not in used and variants.original_name(obj.object_name) not in used:
+                yield _line(_describe(obj))
+
 
 @router.get("/list")
-async def list_objects():
+async def list_objects(prefix: str = "", cursor: str | None = None, limit: int = Query(MAX_LIST, ge=1, le=MAX_LIST)):
     """
-    List all objects in the given bucket
+    List the objects of the bucket whose names start with `prefix`, `limit` at most, as NDJSON:
+    a line {"name", "size", "etag", "last_modified"} per object, in the order of their names.
+    If there are more objects, a last line {"next_cursor"} gives the `cursor` of the next page.
     """
-    return minio_client.list_objects(bucket_name)
+    start_after = None
+    if cursor is not None:
+        start_after = pagination.decode(cursor).get("a")
+        if not isinstance(start_after, str):
+            raise pagination.InvalidCursor("Invalid cursor")
+    # the lines are made in the threadpool, where the next pages of the listing are fetched
+    return StreamingResponse(_page_lines(await _listing(prefix, start_after), limit), media_type=NDJSON)
+
+
+@router.get("/orphans")
+async def list_orphans(prefix: str = "", privileged=Depends(check_admin_privilege)):
+    """
+    List the objects that no image of a dish, carousel, user or canteen refers to, as NDJSON lines
+    like those of /list. The variants of an image are used if the image is.
+
+    The whole bucket is scanned, by pages of objects looked up in the database, so that the memory
+    it takes does not grow with the bucket. Nothing is deleted.
+    """
+    return StreamingResponse(_orphan_lines(await _listing(prefix)), media_type=NDJSON)
 
 @router.get("/{object_name}/info")
 async def get_object_data(object_name: str):
-    return minio_client.stat_object(bucket_name, object_name)
+    return await run_in_threadpool(minio_client.stat_object, bucket_name, object_name)
 
-# @router.get("/get/{object_name}")
-# async def get_object(object_name: str):
-#     # return minio_client.get_object(bucket_name, object_name)
-#     return StreamingResponse(minio_client.get_object(bucket_name, object_name))
+class RangeNotSatisfiable(Exception):
+    pass
 
-@router.post("/upload/")
-async def upload_object(file: Annotated[bytes, File()]):
-    object_name = str(uuid.uuid4())
-    minio_client.put_object(bucket_name, object_name, BytesIO(file), len(file))
-    return {"object_name": object_name}
 
-        
\ No newline at end of file
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    The first and last bytes of a Range header, None for the whole object.
+    Several ranges are answered with the whole object, which HTTP allows.
+    """
+    if header is None:
+        return None
+    m = _RANGE.fullmatch(header.strip())
+    if m is None or not (m[1] or m[2]):
+        return None
+    if not m[1]:
+        # the last bytes
+        if int(m[2]) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(m[2]), 0), size - 1
+    start = int(m[1])
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = min(int(m[2]), size - 1) if m[2] else size - 1
+    if end < start:
+        return None
+    return start, end
+
+
+def _file_chunks(file, start: int, length: int):
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _object_chunks(resp, writer=None):
+    try:
+        for chunk in resp.stream(_CHUNK_SIZE):
+            if writer is not None:
+                writer.write(chunk)
+            yield chunk
+    finally:
+        resp.close()
+        resp.release_conn()
+        if writer is not None:
+            writer.close()
+
+
+async def _stat(object_name: str) -> ObjectInfo:
+    try:
+        stat = await run_in_threadpool(minio_client.stat_object, bucket_name, object_name)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject"):
+            raise HTTPException(status_code=404, detail="No such object") from None
+        raise
+    return ObjectInfo(stat.size, stat.etag, stat.last_modified, stat.content_type or "application/octet-stream")
+
+
+def _read_head(object_name: str) -> bytes:
+    resp = minio_client.get_object(bucket_name, object_name, offset=0, length=12)
+    try:
+        return resp.read()
+    finally:
+        resp.close()
+        resp.release_conn()
+
+
+async def _head(object_name: str) -> bytes:
+    """
+    The first 12 bytes of an object, enough for sniff.
+    """
+    return await run_in_threadpool(_read_head, object_name)
+
+
+async def _stat_variant(object_name: str, variant: str) -> ObjectInfo:
+    name = variants.variant_name(object_name, variant)
+    try:
+        return await _stat(name)
+    except HTTPException:
+        # not made yet: it is only made for the images, accepted by /upload/, which exist.
+        # The objects uploaded before the types were checked are all application/octet-stream,
+        # their type is read from their first bytes.
+        if (await _stat(object_name)).content_type not in CONTENT_TYPES and sniff(await _head(object_name)) is None:
+            raise HTTPException(status_code=404, detail="No such variant") from None
+    try:
+        await variants.generate(object_name)
+    except variants.NotAnImage:
+        raise HTTPException(status_code=404, detail="No such variant") from None
+    return await _stat(name)
+
+
+@router.get("/get/{object_name}")
+async def get_object(object_name: str, request: Request, variant: variants.Variant | None = None):
+    """
+    Download an object, or the byte range of the Range header.
+    With `variant`, the resized WebP variant of an image is sent instead, see variants.
+
+    The body is streamed from the store in chunks, or from the local cache of the hot objects
+    (see disk_cache), with the ETag and Last-Modified of the object for conditional requests.
+    """
+    original = object_name
+    if variant is not None:
+        if variants.original_name(object_name) != object_name:
+            raise HTTPException(status_code=400, detail="A variant has no variants")
+        object_name = variants.variant_name(original, variant)
+    hit = static_cache.open(object_name)
+    if hit:
+        info, file = hit
+    else:
+        info, file = await (_stat_variant(original, variant) if variant else _stat(object_name)), None
+    headers = {
+        "ETag": f'"{info.etag}"',
+        "Last-Modified": email.utils.format_datetime(info.last_modified, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": STATIC_CACHE_CONTROL,
+    }
+    if conditional.fresh(request, headers["ETag"], info.last_modified):
+        if file is not None:
+            file.close()
+        return Response(status_code=304, headers=headers)
+    try:
+        # with If-Range, the range is only sent if the client has this version of the object
+        if request.headers.get("if-range") in (None, headers["ETag"]):
+            byte_range = parse_range(request.headers.get("range"), info.size)
+        else:
+            byte_range = None
+    except RangeNotSatisfiable:
+        if file is not None:
+            file.close()
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{info.size}"})
+    start, end = byte_range or (0, info.size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+    if file is not None:
+        body = _file_chunks(file, start, end - start + 1)
+    else:
+        resp = await run_in_threadpool(
+            minio_client.get_object,
+            bucket_name,
+            object_name,
+            offset=start,
+            length=end - start + 1 if byte_range else 0,
+            # the version which was stat'ed
+            request_headers={"If-Match": headers["ETag"]},
+        )
+        writer = static_cache.writer(object_name, info) if not byte_range and static_cache.cacheable(info) else None
+        body = _object_chunks(resp, writer)
+    return StreamingResponse(body, status_code=206 if byte_range else 200, media_type=info.content_type, headers=headers)
+
+_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+
+@router.post("/upload/", openapi_extra=_UPLOAD_BODY)
+async def upload_object(request: Request, background_tasks: BackgroundTasks):
+    """
+    Upload an image in the `file` field of a multipart form. Its variants are made after the response.
+
+    The form is parsed here rather than by FastAPI, so that a body too large is refused from its
+    Content-Length before it is read. The parser spools the file to a temporary file past 1 MiB,
+    which is then sent to the store in parts of PART_SIZE, so an upload holds at most a part in memory.
+    """
+    length = request.headers.get("content-length")
+    if length is None:
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    if not length.isdigit() or int(length) > MAX_UPLOAD_SIZE + _FORM_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"Files are limited to {MAX_UPLOAD_SIZE} bytes")
+    async with request.form(max_files=1, max_fields=0) as form:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=422, detail="No file")
+        if file.size is None or file.size > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail=f"Files are limited to {MAX_UPLOAD_SIZE} bytes")
+        content_type = sniff(await file.read(12))
+        if content_type is None or file.content_type not in (content_type, None, "application/octet-stream"):
+            raise HTTPException(status_code=415, detail=f"Only {', '.join(sorted(CONTENT_TYPES))} are accepted")
+        await file.seek(0)
+        object_name = str(uuid.uuid4())
+        await run_in_threadpool(
+            minio_client.put_object,
+            bucket_name,
+            object_name,
+            file.file,
+            file.size,
+            content_type=content_type,
+            part_size=PART_SIZE,
+            # parts are read ahead for the parallel uploads, one at a time keeps a single part in memory
+            num_parallel_uploads=1,
+        )
+    background_tasks.add_task(variants.generate_in_background, object_name)
+    return {"object_name": object_name}
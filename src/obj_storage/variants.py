@@ -0,0 +1,146 @@
+"""
+Resized WebP variants of the uploaded images.
+
+Phones list dishes with thumbnails of about 100px, which were cut from the uploaded photos of
+several MB. Every uploaded image now gets its VARIANTS, stored next to it in the bucket as
+`{object_name}.{variant}.webp` and served by `/static/get/{object_name}?variant=...`.
+
+The variants are rendered in a process pool, as resizing and encoding are CPU bound and hold the GIL.
+They are made in the background after an upload, and on the first request of a variant which does
+not exist yet (e.g. for the images uploaded before). A variant only depends on its original and
+VARIANTS, so making it again gives the same object: concurrent requests for the variants of an
+object wait for the same rendering.
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Literal
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .client import bucket_name, minio_client
+
+# name -> the box the image is shrunk to fit in, in pixels
+VARIANTS: dict[str, tuple[int, int]] = {
+    "thumb": (160, 160),
+    "medium": (640, 640),
+}
+Variant = Literal["thumb", "medium"]
+QUALITY = 80
+CONTENT_TYPE = "image/webp"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+_pool: ProcessPoolExecutor | None = None
+# object name -> the rendering of its variants in progress
+_inflight: dict[str, asyncio.Task] = {}
+
+metrics = {"rendered": 0, "failed": 0}
+
+
+class NotAnImage(ValueError):
+    pass
+
+
+def variant_name(object_name: str, variant: str) -> str:
+    return f"{object_name}.{variant}.webp"
+
+
+def original_name(object_name: str) -> str:
+    """
+    The name of the original of a variant, the name itself for other objects.
+    """
+    for variant in VARIANTS:
+        suffix = f".{variant}.webp"
+        if object_name.endswith(suffix):
+            return object_name[: -len(suffix)]
+    return object_name
+
+
+def render(data: bytes) -> dict[str, bytes]:
+    """
+    The variants of an image, encoded. Runs in the worker processes.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # phones store the orientation of photos in their EXIF
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        out = {}
+        for variant, box in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(box, Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            resized.save(buf, "WEBP", quality=QUALITY, method=4)
+            out[variant] = buf.getvalue()
+        return out
+
+
+def _pool_of_workers() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # not forked: the server has threads (threadpool, loop monitor...) whose locks a fork would copy held
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return _pool
+
+
+def _fetch(object_name: str) -> bytes:
+    resp = minio_client.get_object(bucket_name, object_name)
+    try:
+        return resp.read()
+    finally:
+        resp.close()
+        resp.release_conn()
+
+
+def _store(object_name: str, variants: dict[str, bytes]) -> None:
+    for variant, data in variants.items():
+        minio_client.put_object(bucket_name, variant_name(object_name, variant), io.BytesIO(data), len(data), content_type=CONTENT_TYPE)
+
+
+async def _generate(object_name: str) -> None:
+    try:
+        data = await run_in_threadpool(_fetch, object_name)
+        try:
+            variants = await asyncio.get_running_loop().run_in_executor(_pool_of_workers(), render, data)
+        except (UnidentifiedImageError, Image.DecompressionBombError):
+            raise NotAnImage(f"{object_name} is not an image") from None
+        await run_in_threadpool(_store, object_name, variants)
+    except Exception:
+        metrics["failed"] += 1
+        raise
+    metrics["rendered"] += 1
+
+
+async def generate(object_name: str) -> None:
+    """
+    Make and store the variants of an object, or wait for the rendering in progress.
+    """
+    task = _inflight.get(object_name)
+    if task is None:
+        task = _inflight[object_name] = asyncio.create_task(_generate(object_name))
+        task.add_done_callback(lambda _: _inflight.pop(object_name, None))
+    await asyncio.shield(task)
+
+
+async def generate_in_background(object_name: str) -> None:
+    """
+    `generate` for the background tasks, whose failures are only logged: the variant is made on its first request.
+    """
+    try:
+        await generate(object_name)
+    except Exception as e:
+        print(f"Warning: failed to make the variants of {object_name}: {e!r}")
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def stats() -> dict:
+    return {**metrics, "in_progress": len(_inflight), "workers": IMAGE_WORKERS}
@@ -0,0 +1,170 @@
+"""
+Guards for calls to external services: a bulkhead limiting the concurrent calls and a
+circuit breaker failing fast while the service keeps failing.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class Unavailable(Exception):
+    """
+    The service cannot answer now: the call was refused without reaching it, or it failed.
+    """
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Unavailable):
+    pass
+
+
+class BulkheadFull(Unavailable):
+    pass
+
+
+class UpstreamError(Unavailable):
+    """
+    The service timed out or failed, as opposed to answering that the request is wrong.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, calls fail at once with CircuitOpen.
+    After `reset_timeout` seconds a single trial call is let through (half open): its success closes the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_running = False
+
+    def _before(self) -> None:
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpen("Circuit open", remaining)
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._trial_running:
+                self.rejected += 1
+                raise CircuitOpen("Circuit half open", self.reset_timeout)
+            self._trial_running = True
+
+    def _success(self) -> None:
+        self.failures = 0
+        self.state = self.CLOSED
+
+    def _failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], is_failure: Callable[[BaseException], bool]) -> T:
+        """
+        :param is_failure: which exceptions of fn count as failures of the service. Others pass through as successes.
+        """
+        self._before()
+        trial = self.state == self.HALF_OPEN
+        try:
+            ret = await fn()
+        except Exception as e:
+            if is_failure(e):
+                self._failure()
+            else:
+                self._success()
+            raise
+        else:
+            self._success()
+            return ret
+        finally:
+            if trial:
+                self._trial_running = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class Bulkhead:
+    """
+    Lets at most `max_concurrent` calls run at once. A call waits at most `max_wait` seconds for a slot, then fails with BulkheadFull.
+    """
+
+    def __init__(self, max_concurrent: int = 20, max_wait: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise BulkheadFull("Too many concurrent calls", self.max_wait) from None
+        self.active += 1
+        try:
+            return await fn()
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {"max_concurrent": self.max_concurrent, "active": self.active, "rejected": self.rejected}
+
+
+class LatencyRecorder:
+    """
+    Latencies of the last `window` calls, in seconds.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.errors = 0
+        self._recent: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        self.count += 1
+        self.errors += error
+        self._recent.append(seconds)
+
+    def stats(self) -> dict:
+        recent = sorted(self._recent)
+
+        def percentile(p: float) -> float | None:
+            return recent[min(len(recent) - 1, int(len(recent) * p))] * 1000 if recent else None
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": recent[-1] * 1000 if recent else None,
+        }
@@ -1,39 +1,286 @@
+"""
+Async client of the CAS server of SDU (pass.sdu.edu.cn).
+
+All the requests share one pooled httpx.AsyncClient with explicit timeouts.
+The server can be swapped with `configure`, e.g. for the fake CAS server in bench/fake_cas.py.
+
+Returning users only need their credentials checked (verify_credentials): a recent
+successful check is reused from a cache of salted hashes, otherwise only a TGT is
+requested and the serviceValidate exchange is skipped. Both are configured by
+environment variables, SDU_SSO_CREDENTIAL_TTL=0 and SDU_SSO_SKIP_VALIDATE=0 turn them off.
+
+Every request goes through a bulkhead (SDU_SSO_MAX_CONCURRENT requests at once) and a
+circuit breaker opened by SDU_SSO_FAILURE_THRESHOLD consecutive timeouts, transport
+errors or 5xx responses, so a slow CAS server makes logins fail fast with
+resilience.Unavailable instead of piling up. These failures raise resilience.UpstreamError,
+also an Unavailable, so that they are not mistaken for wrong credentials.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import io
+import os
+import secrets
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
 import httpx
-import xml.dom.minidom
 
-def login(username, password, baseURL="https://pass.sdu.edu.cn/") -> str:
-# 发送第一个请求，获取ticket
-    ticket = httpx.post(
-        f"{baseURL}cas/restlet/tickets",
-        # data={"username": username, "password": password},
+from resilience import Bulkhead, CircuitBreaker, LatencyRecorder, Unavailable, UpstreamError
+
+BASE_URL = os.getenv("SDU_SSO_BASE_URL", "https://pass.sdu.edu.cn/")
+SERVICE = "https://service.sdu.edu.cn/tp_up/view?m=up"
+TIMEOUT = httpx.Timeout(float(os.getenv("SDU_SSO_TIMEOUT", "5")), connect=2.0)
+# httpx timeouts apply to each network operation, this bounds a whole request
+DEADLINE = float(os.getenv("SDU_SSO_DEADLINE", "10"))
+# Retry-After of the logins which failed on an error of the CAS server
+RETRY_AFTER_FAILURE = 5.0
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+CREDENTIAL_TTL = float(os.getenv("SDU_SSO_CREDENTIAL_TTL", "600"))
+SKIP_VALIDATE = os.getenv("SDU_SSO_SKIP_VALIDATE", "1") == "1"
+
+breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("SDU_SSO_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("SDU_SSO_RESET_TIMEOUT", "30")),
+)
+bulkhead = Bulkhead(
+    max_concurrent=int(os.getenv("SDU_SSO_MAX_CONCURRENT", "20")),
+    max_wait=float(os.getenv("SDU_SSO_MAX_WAIT", "1")),
+)
+latency = LatencyRecorder()
+
+metrics = {
+    "tgt_requests": 0,
+    "service_validations": 0,
+    "validations_skipped": 0,
+    "credential_cache_hits": 0,
+    "credential_cache_misses": 0,
+}
+
+_client: httpx.AsyncClient | None = None
+_base_url = BASE_URL
+_transport: httpx.AsyncBaseTransport | None = None
+_timeout = TIMEOUT
+_deadline = DEADLINE
+
+
+def configure(
+    base_url: str | None = None,
+    transport: httpx.AsyncBaseTransport | None = None,
+    timeout: httpx.Timeout | None = None,
+    deadline: float | None = None,
+) -> None:
+    """
+    Point the client to another CAS server. The current client is dropped, call aclose() first if it is in use.
+    """
+    global _client, _base_url, _transport, _timeout, _deadline
+    _base_url = base_url or BASE_URL
+    _transport = transport
+    _timeout = timeout or TIMEOUT
+    _deadline = deadline or DEADLINE
+    _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=_base_url, timeout=_timeout, limits=LIMITS, transport=_transport
+        )
+    return _client
+
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _is_failure(e: BaseException) -> bool:
+    # wrong credentials are answered quickly by a healthy server, they do not count
+    return isinstance(e, (TimeoutError, httpx.TimeoutException, httpx.TransportError)) or (
+        isinstance(e, httpx.HTTPStatusError) and e.response.status_code >= 500
+    )
+
+
+async def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request to the CAS server through the bulkhead and the circuit breaker.
+    """
+
+    async def send() -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(get_client().request(method, url, **kwargs), _deadline)
+            if response.status_code >= 500:
+                response.raise_for_status()
+        except Exception:
+            latency.record(time.perf_counter() - start, error=True)
+            raise
+        latency.record(time.perf_counter() - start)
+        return response
+
+    try:
+        return await bulkhead.call(lambda: breaker.call(send, _is_failure))
+    except Exception as e:
+        if _is_failure(e):
+            # not the answer to wrong credentials, which the callers would report as such
+            raise UpstreamError("CAS server failed", RETRY_AFTER_FAILURE) from e
+        raise
+
+
+class CredentialCache:
+    """
+    Remembers recent successful credential checks as salted PBKDF2 hashes, never the passwords.
+    """
+
+    ITERATIONS = 10_000
+
+    def __init__(self, ttl: float, maxsize: int = 10_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, bytes, bytes]] = OrderedDict()  # username -> (expiry, salt, hash)
+        self._lock = threading.Lock()
+
+    def _hash(self, salt: bytes, username: str, password: str) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", f"{username}\0{password}".encode(), salt, self.ITERATIONS)
+
+    def check(self, username: str, password: str) -> bool:
+        with self._lock:
+            entry = self._data.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            return False
+        return hmac.compare_digest(entry[2], self._hash(entry[1], username, password))
+
+    def remember(self, username: str, password: str) -> None:
+        if self.ttl <= 0:
+            return
+        salt = secrets.token_bytes(16)
+        entry = (time.monotonic() + self.ttl, salt, self._hash(salt, username, password))
+        with self._lock:
+            self._data[username] = entry
+            self._data.move_to_end(username)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def forget(self, username: str) -> None:
+        with self._lock:
+            self._data.pop(username, None)
+
+
+credentials = CredentialCache(CREDENTIAL_TTL)
+
+
+class InvalidCredentials(Exception):
+    """
+    The CAS server refused the credentials, or did not answer as it does to valid ones.
+    """
+
+
+async def _request_tgt(username: str, password: str) -> str:
+    metrics["tgt_requests"] += 1
+    # 发送第一个请求，获取ticket
+    response = await _send(
+        "POST",
+        "cas/restlet/tickets",
         content=f'username={username}&password={password}',
-    ).text
+    )
 
     # 检查ticket是否以TGT开头
-    assert ticket.startswith("TGT"), "ticket should start with TGT. Check your username and password."
+    # not an assert: this is the only check of the password when the validation is skipped, and python -O drops asserts
+    ticket = response.text
+    if response.status_code != 201 or not ticket.startswith("TGT"):
+        raise InvalidCredentials("ticket should start with TGT. Check your username and password.")
+    return ticket
+
+
+async def login(username: str, password: str) -> str:
+    ticket = await _request_tgt(username, password)
 
     # 发送第二个请求，获取sTicket
-    sTicket = httpx.post(f"{baseURL}cas/restlet/tickets/{ticket}",content="service=https://service.sdu.edu.cn/tp_up/view?m=up", headers={"Content-Type": "text/plain"}).text
+    sTicket = (await _send("POST", f"cas/restlet/tickets/{ticket}", content=f"service={SERVICE}", headers={"Content-Type": "text/plain"})).text
 
     # 检查sTicket是否以ST开头
-    assert sTicket.startswith("ST"), "sTicket should start with ST"
+    if not sTicket.startswith("ST"):
+        raise InvalidCredentials("sTicket should start with ST")
 
     return sTicket
 
-def get_user_name_and_id(sTicket, baseURL="https://pass.sdu.edu.cn/") -> tuple[str, str]:
-    user_data = xml.dom.minidom.parseString(httpx.get(
-        f"{baseURL}cas/serviceValidate",
+
+def parse_user(xml_text: str) -> tuple[str, str]:
+    """
+    Read the name and the student id from the response of serviceValidate, in a single pass.
+    """
+    prefixes: dict[str, str] = {}  # namespace uri -> prefix
+    values: dict[str, str | None] = {}
+    for event, item in ET.iterparse(io.StringIO(xml_text), events=("start-ns", "end")):
+        if event == "start-ns":
+            prefix, uri = item
+            prefixes[uri] = prefix
+            continue
+        uri, _, local = item.tag[1:].partition("}") if item.tag.startswith("{") else ("", "", item.tag)
+        values.setdefault(f"{prefixes.get(uri, '')}:{local}", item.text)
+    name, student_id = values["cas:USER_NAME"], values["sso:user"]
+    assert name and student_id, "serviceValidate did not return the user"
+    return name, student_id
+
+
+async def get_user_name_and_id(sTicket: str) -> tuple[str, str]:
+    metrics["service_validations"] += 1
+    response = await _send(
+        "GET",
+        "cas/serviceValidate",
         params={
             "ticket": sTicket,
-            "service": "https://service.sdu.edu.cn/tp_up/view?m=up",
+            "service": SERVICE,
         },
-    ).text)
-    name = user_data.getElementsByTagName("cas:USER_NAME")[0].childNodes[0].data
-    student_id = user_data.getElementsByTagName("sso:user")[0].childNodes[0].data
-    return name, student_id
+    )
+    return parse_user(response.text)
+
+
+async def verify_credentials(username: str, password: str) -> None:
+    """
+    Check the credentials of a user who already has an account. Raises if they are invalid.
+    """
+    if credentials.ttl > 0:
+        if await asyncio.to_thread(credentials.check, username, password):
+            metrics["credential_cache_hits"] += 1
+            return
+        metrics["credential_cache_misses"] += 1
+    if SKIP_VALIDATE:
+        # granting a TGT is enough to prove the password, the user data is already known
+        await _request_tgt(username, password)
+        metrics["validations_skipped"] += 1
+    else:
+        _, sdu_id = await get_user_name_and_id(await login(username, password))
+        if sdu_id != username:
+            raise InvalidCredentials("serviceValidate returned another user")
+    # only reached once the CAS server accepted the password
+    await asyncio.to_thread(credentials.remember, username, password)
+
+
+def stats() -> dict:
+    return {
+        **metrics,
+        "credential_cache_size": len(credentials._data),
+        "circuit_breaker": breaker.stats(),
+        "bulkhead": bulkhead.stats(),
+        "latency": latency.stats(),
+    }
+
 
 if __name__ == "__main__":
     import getpass
-    username = input("Username: ")
-    password = getpass.getpass()
-    print(get_user_name_and_id(login(username, password)))
\ No newline at end of file
+
+    async def main():
+        username = input("Username: ")
+        password = getpass.getpass()
+        print(await get_user_name_and_id(await login(username, password)))
+        await aclose()
+
+    asyncio.run(main())
@@ -1,5 +1,15 @@
-from .database import SessionLocal, engine
+from .database import (
+    AsyncReadSessionLocal,
+    AsyncSessionLocal,
+    ReadSessionLocal,
+    SessionLocal,
+    async_engine,
+    async_read_engine,
+    engine,
+    read_engine,
+)
 from .models import Base
+from . import search
 
 
 def get_db():
@@ -9,4 +19,41 @@ def get_db():
     finally:
         db.close()
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+
+async def get_session():
+    """
+    The session of the async routes, to be used through sql_app.crud.aio.run: an AsyncSession if DB_MODE is async, a Session otherwise.
+    """
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_session():
+    """
+    Like get_session, on the read-only connections: for the routes which do not write.
+    """
+    if AsyncReadSessionLocal is None:
+        db = ReadSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+for e in {engine, read_engine, async_engine, async_read_engine} - {None}:
+    search.register_functions(getattr(e, "sync_engine", e))
+Base.metadata.create_all(bind=engine)
+# create_all skips existing tables, so indexes added to them later are created here
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+search.create_index(engine)
@@ -0,0 +1,113 @@
+"""
+Bounded TTL + LRU caches for the read paths of nearly static data.
+
+Cached crud functions must return plain data (pydantic models or transient copies),
+never ORM objects attached to the session that loaded them. The write paths invalidate the keys
+they affect. Caches are per process: with several workers, the TTL bounds how long
+another worker may serve stale data.
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+caches: dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    """
+    A thread safe mapping from keys to values which expire after `ttl` seconds.
+    When full, the least recently used key is evicted.
+    """
+
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = 300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # bumped by every invalidation, so that a value loaded before a write is not cached after it
+        self.generation = 0
+        self._data: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, key: tuple) -> tuple[bool, Any]:
+        """
+        :return: (True, value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key: tuple, value: Any, generation: int | None = None) -> None:
+        """
+        :param generation: the generation read before loading the value. If the cache has been invalidated since, the value is dropped.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *prefixes: tuple) -> None:
+        """
+        Drop the keys starting with any of the prefixes, e.g. ("get_all",) drops every page of get_all.
+        """
+        with self._lock:
+            self.generation += 1
+            for key in [k for k in self._data if any(k[: len(p)] == p for p in prefixes)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+def cached(cache: TTLCache, snapshot: Callable[[Any], Any]):
+    """
+    Cache a crud function `fn(db, *args, **kwargs)` under the key (fn.__name__, *args, *kwargs).
+
+    :param snapshot: turns the result of fn into the plain data which is cached and returned
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(db, *args, **kwargs):
+            key = (fn.__name__, *args, *sorted(kwargs.items()))
+            hit, value = cache.get(key)
+            if hit:
+                return value
+            generation = cache.generation
+            value = snapshot(fn(db, *args, **kwargs))
+            cache.set(key, value, generation)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict[str, dict[str, Any]]:
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -0,0 +1,126 @@
+"""
+Write-behind counters of the dishes.
+
+Marking a dish used to increment its `count_of_mark` in the transaction of the mark, so that all
+the marks of a popular dish queued on the update of the same row. The deltas are now added up in
+memory by `add` and written in batches by `flush`, which the app runs every COUNTER_FLUSH_INTERVAL
+seconds and on shutdown: a burst of marks on a dish becomes a single UPDATE.
+
+Until they are written, the deltas are merged into the values read through `value` and `merge`,
+so that a write is seen by the reads following it in the process.
+
+Deltas not flushed yet are lost if the process crashes, `reconcile` counts the marks again.
+"""
+
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from .models import Dish, Mark
+
+FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "1"))
+# Buffered columns of the dishes table
+COLUMNS = ("count_of_mark",)
+
+_lock = threading.Lock()
+# one flush at a time
+_flush_lock = threading.Lock()
+# (column, dish id) -> delta
+_pending: defaultdict[tuple[str, int], int] = defaultdict(int)
+# the batch being written, still merged into the reads until it is committed
+_flushing: dict[tuple[str, int], int] = {}
+
+metrics = {"deltas": 0, "flushes": 0, "rows_written": 0}
+
+
+def add(column: str, dish_id: int, delta: int) -> None:
+    assert column in COLUMNS, f"{column} is not a buffered counter"
+    with _lock:
+        _pending[(column, dish_id)] += delta
+        metrics["deltas"] += 1
+
+
+def value(column: str, dish_id: int, stored: int | None) -> int:
+    """
+    The value of a counter: the stored value with the deltas not written yet.
+    """
+    key = (column, dish_id)
+    with _lock:
+        return (stored or 0) + _pending.get(key, 0) + _flushing.get(key, 0)
+
+
+def merge(column: str, rows):
+    """
+    Merge the deltas into (dish id, stored value) rows.
+    """
+    with _lock:
+        if not _pending and not _flushing:
+            return [(dish_id, stored or 0) for dish_id, stored in rows]
+        return [
+            (dish_id, (stored or 0) + _pending.get((column, dish_id), 0) + _flushing.get((column, dish_id), 0))
+            for dish_id, stored in rows
+        ]
+
+
+def flush(db: Session) -> int:
+    """
+    Write the pending deltas, one executemany per column. Returns the number of dishes updated.
+    On failure, the deltas are kept for the next flush.
+    """
+    with _flush_lock:
+        return _flush(db)
+
+
+def _flush(db: Session) -> int:
+    global _flushing
+    with _lock:
+        if not _pending:
+            return 0
+        _flushing = {k: v for k, v in _pending.items() if v}
+        _pending.clear()
+    batch = _flushing
+    try:
+        table = Dish.__table__
+        for column in COLUMNS:
+            params = [{"dish_id": dish_id, "delta": delta} for (c, dish_id), delta in batch.items() if c == column]
+            if params:
+                db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("dish_id"))
+                    .values({column: table.c[column] + bindparam("delta")}),
+                    params,
+                )
+        # no versions.bump: the lists with an ETag do not show the counters
+        db.commit()
+    except Exception:
+        db.rollback()
+        with _lock:
+            for key, delta in batch.items():
+                _pending[key] += delta
+        raise
+    finally:
+        with _lock:
+            _flushing = {}
+    metrics["flushes"] += 1
+    metrics["rows_written"] += len(batch)
+    return len(batch)
+
+
+def reconcile(db: Session) -> None:
+    """
+    Count the marks of every dish again, after the pending deltas are written.
+    A mark added while it runs may be counted twice, until the next reconciliation.
+    """
+    with _flush_lock:
+        _flush(db)
+        marks = select(func.count()).where(Mark.dish_id == Dish.id).scalar_subquery()
+        db.execute(update(Dish).values(count_of_mark=marks).execution_options(synchronize_session=False))
+        db.commit()
+
+
+def stats() -> dict:
+    with _lock:
+        return {**metrics, "pending": len(_pending), "flush_interval": FLUSH_INTERVAL}
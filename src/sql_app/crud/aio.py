@@ -0,0 +1,46 @@
+"""
+Async versions of the crud functions.
+
+`await run(db, crud_function, *args)` is the async version of `crud_function(db, *args)`:
+- with an AsyncSession (DB_MODE=async), it runs on the event loop through AsyncSession.run_sync,
+  every query being awaited on aiosqlite;
+- with a Session (DB_MODE=sync), it runs in the threadpool, like a `def` route does.
+
+So that the routes are written once for both modes during the migration, and the
+crud functions keep a single implementation.
+
+The transaction is ended after each call (the crud functions commit their writes themselves), so the
+session gives its connection back to the pool between the calls instead of holding it until the end of
+the request. Otherwise requests holding connections would wait for the threadpool while the threads
+wait for a connection.
+"""
+
+from typing import Callable, Concatenate, ParamSpec, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+def _call(db: Session, fn: Callable[Concatenate[Session, P], T], *args: P.args, **kwargs: P.kwargs) -> T:
+    try:
+        ret = fn(db, *args, **kwargs)
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+    return ret
+
+
+async def run(
+    db: Session | AsyncSession,
+    fn: Callable[Concatenate[Session, P], T],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(_call, fn, *args, **kwargs)
+    return await run_in_threadpool(_call, db, fn, *args, **kwargs)
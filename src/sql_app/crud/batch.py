@@ -0,0 +1,23 @@
+"""
+Batch gets: the rows of a list of ids in one IN query, instead of a request and a query per id.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import Base
+
+
+def get_many(db: Session, model: type[Base], ids: list[int]) -> dict:
+    """
+    The rows of `model` with these ids, in the order of the ids, and the ids without a row.
+    Shaped as a schemas.BatchResult.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {"items": [], "missing": []}
+    found = {row.id: row for row in db.scalars(select(model).where(model.id.in_(ids)))}
+    return {
+        "items": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found],
+    }
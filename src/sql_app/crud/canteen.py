@@ -1,18 +1,37 @@
+from sqlalchemy import delete as sql_delete
 from sqlalchemy.sql.expression import and_
 from sqlalchemy.orm import Session
 
+from .. import versions
+from ..cache import TTLCache, cached
 from ..models import Canteen, Floor
-from ..schemas import CanteenBase, CanteenItem, FloorData
+from ..schemas import CanteenBase, CanteenItem, FloorData, FloorStored
 
+canteen_cache = TTLCache("canteen", maxsize=256, ttl=300)
 
-def get_info(db: Session, canteen_id: int) -> Canteen | None:
+
+def _canteen(db_canteen: Canteen | None) -> CanteenItem | None:
+    return CanteenItem.model_validate(db_canteen, from_attributes=True) if db_canteen else None
+
+
+def _canteens(db_canteens: list[Canteen]) -> list[CanteenItem]:
+    return [CanteenItem.model_validate(i, from_attributes=True) for i in db_canteens]
+
+
+def _floors(db_floors: list[Floor]) -> list[FloorStored]:
+    return [FloorStored.model_validate(i, from_attributes=True) for i in db_floors]
+
+
+@cached(canteen_cache, _canteen)
+def get_info(db: Session, canteen_id: int) -> CanteenItem | None:
     """
     Get the information of a canteen by its id.
     """
     return db.query(Canteen).filter(Canteen.id == canteen_id).first()
 
 
-def get_all(db: Session, skip: int = 0, limit: int = 200) -> list[Canteen]:
+@cached(canteen_cache, _canteens)
+def get_all(db: Session, skip: int = 0, limit: int = 200) -> list[CanteenItem]:
     """
     Get all canteens.
     """
@@ -33,8 +52,10 @@ def add(db: Session, canteen: CanteenBase) -> Canteen:
     )
 
     db.add(db_canteen)
+    versions.bump(db, "canteens")
     db.commit()
     db.refresh(db_canteen)
+    canteen_cache.invalidate(("get_all",), ("get_info", db_canteen.id), ("get_by_campus", db_canteen.campus))
     return db_canteen
 
 
@@ -42,8 +63,15 @@ def delete(db: Session, canteen_id: int) -> dict[str, str]:
     """
     Delete a canteen by its id.
     """
-    db.query(Canteen).filter(Canteen.id == canteen_id).delete()
+    campuses = db.scalars(sql_delete(Canteen).where(Canteen.id == canteen_id).returning(Canteen.campus)).all()
+    versions.bump(db, "canteens")
     db.commit()
+    canteen_cache.invalidate(
+        ("get_all",),
+        ("get_info", canteen_id),
+        ("get_floors_info", canteen_id),
+        *(("get_by_campus", campus) for campus in campuses),
+    )
     return {"detail": "Delete Success"}
 
 
@@ -60,11 +88,14 @@ def update(db: Session, data: CanteenItem) -> dict[str, str]:
     db_canteen.image = data.image
     db_canteen.icon = data.icon
     db_canteen.floors_count = data.floors_count
+    versions.bump(db, "canteens")
     db.commit()
+    canteen_cache.invalidate(("get_all",), ("get_info", data.id), ("get_by_campus", db_canteen.campus))
     return {"detail": "Update Success"}
 
 
-def get_by_campus(db: Session, campus_name: str) -> list[Canteen]:
+@cached(canteen_cache, _canteens)
+def get_by_campus(db: Session, campus_name: str) -> list[CanteenItem]:
     """
     Get all canteens in a campus.
     """
@@ -78,7 +109,8 @@ def search(db: Session, name: str) -> list[Canteen]:
     return db.query(Canteen).filter(Canteen.name.like(f"%{name}%")).all()
 
 
-def get_floors_info(db: Session, canteen_id: int) -> list[Floor]:
+@cached(canteen_cache, _floors)
+def get_floors_info(db: Session, canteen_id: int) -> list[FloorStored]:
     """
     Get the floors information of a canteen.
     """
@@ -99,6 +131,7 @@ def update_floor_info(db: Session, floor: FloorData) -> dict[str, str]:
     assert db_floor, "No such floor"
     db_floor.count_of_windows = floor.count_of_windows
     db.commit()
+    canteen_cache.invalidate(("get_floors_info", floor.canteen))
     return {"detail": "Update Success"}
 
 
@@ -114,4 +147,5 @@ def add_floor(db: Session, floor: FloorData) -> Floor:
     db.add(db_floor)
     db.commit()
     db.refresh(db_floor)
+    canteen_cache.invalidate(("get_floors_info", floor.canteen))
     return db_floor
@@ -1,19 +1,35 @@
+from sqlalchemy import delete as sql_delete
 from sqlalchemy.orm import Session
 
+from .. import versions
+from ..cache import TTLCache, cached
 from ..models import Carousel
-from ..schemas import CarouselItem
+from ..schemas import CarouselItem, CarouselStored
+
+carousel_cache = TTLCache("carousel", maxsize=64, ttl=300)
+
+
+def _carousels(db_carousels: list[Carousel]) -> list[CarouselStored]:
+    return [CarouselStored.model_validate(i, from_attributes=True) for i in db_carousels]
+
 
 def add(db: Session, carousel: CarouselItem) -> Carousel:
     db_carousel = Carousel(canteen=carousel.canteen,
                           image=carousel.image)
     db.add(db_carousel)
+    versions.bump(db, "carousels", carousel.canteen)
     db.commit()
     db.refresh(db_carousel)
+    carousel_cache.invalidate(("get", db_carousel.canteen))
     return db_carousel
 
-def get(db: Session, canteen: int) -> list[Carousel]:
+@cached(carousel_cache, _carousels)
+def get(db: Session, canteen: int) -> list[CarouselStored]:
     return db.query(Carousel).filter(Carousel.canteen == canteen).all()
 
 def delete(db: Session, cid: int):
-    db.query(Carousel).filter(Carousel.id == cid).delete()
+    canteens = db.scalars(sql_delete(Carousel).where(Carousel.id == cid).returning(Carousel.canteen)).all()
+    if canteens:
+        versions.bump(db, "carousels", *canteens)
     db.commit()
+    carousel_cache.invalidate(*(("get", canteen) for canteen in canteens))
@@ -1,59 +1,128 @@
-from typing import List
+from sqlalchemy import case, delete as sql_delete, func, literal, select, update as sql_update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
-from ..models import Comment, Dish
+from ..models import Comment, Dish, DishRating
+from ..pagination import Page, keyset
+from .. import versions
 from ..schemas import CommentItem
 
+# The average vote of a dish without votes
+DEFAULT_VOTE = 2.5
+
+# The ratings are changed by SQL statements computed from the comment rows, never from values read
+# in Python: the first of them takes SQLite's write lock, so concurrent votes are serialized and none is lost.
+
+def _has_content():
+    return func.length(func.coalesce(Comment.content, "")) > 0
+
+def _derive(db: Session, *dish_ids: int) -> list[int]:
+    """
+    Copy the ratings of the dishes (all of them without dish_ids) to their columns.
+    Returns the canteens of the dishes.
+    """
+    stmt = sql_update(Dish).where(Dish.id == DishRating.dish_id)
+    if dish_ids:
+        stmt = stmt.where(Dish.id.in_(dish_ids))
+    return db.scalars(stmt.values(
+        average_vote=case((DishRating.vote_count > 0, DishRating.vote_sum / DishRating.vote_count), else_=DEFAULT_VOTE),
+        count_of_votes=DishRating.vote_count,
+        count_of_comments=DishRating.comment_count,
+    ).returning(Dish.canteen).execution_options(synchronize_session=False)).all()
+
+def _tally(db: Session, comment_id: int, sign: int) -> list[int] | None:
+    """
+    Add (sign=1) or remove (sign=-1) the vote of a comment to the rating of its dish.
+    Returns the canteen of the dish (none if the dish is gone), None if there is no such comment.
+    """
+    stmt = insert(DishRating).from_select(
+        ["dish_id", "vote_sum", "vote_count", "comment_count"],
+        select(Comment.dish_id, Comment.vote * sign, literal(sign), case((_has_content(), sign), else_=0))
+        .where(Comment.id == comment_id),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DishRating.dish_id],
+        set_={
+            "vote_sum": DishRating.vote_sum + stmt.excluded.vote_sum,
+            "vote_count": DishRating.vote_count + stmt.excluded.vote_count,
+            "comment_count": DishRating.comment_count + stmt.excluded.comment_count,
+        },
+    ).returning(DishRating.dish_id)
+    dish_id = db.scalar(stmt)
+    if dish_id is None:
+        return None
+    return _derive(db, dish_id)
+
+def _changed(db: Session, *canteens: list[int] | None) -> None:
+    # before the commit: the dishes of the canteens have new ratings
+    canteens = [c for tallied in canteens for c in tallied or ()]
+    if canteens:
+        versions.bump(db, "dishes", *canteens)
+
 def post_comment(db: Session, comment: CommentItem) -> Comment:
     # check if the user has already commented on the dish
     if db.query(Comment).filter(Comment.user_id == comment.user_id).filter(Comment.dish_id == comment.dish_id).first():
         raise ValueError("User has already commented on the dish")
+    db_dish: Dish | None = db.query(Dish).filter(Dish.id == comment.dish_id).first()
+    assert db_dish, "No such dish"
     db_comment = Comment(user_id=comment.user_id,
                          dish_id=comment.dish_id,
                         vote=comment.vote,
                         content=comment.content, 
                         time=comment.time)
-    db_dish: Dish | None = db.query(Dish).filter(Dish.id == comment.dish_id).first()
-    assert db_dish, "No such dish"
-    if comment.content:
-        db_dish.count_of_comments += 1
-
-    db_dish.average_vote = (db_dish.average_vote * db_dish.count_of_votes + comment.vote) / (db_dish.count_of_votes + 1)
-    db_dish.count_of_votes += 1
     db.add(db_comment)
+    db.flush()
+    _changed(db, _tally(db, db_comment.id, 1))
     db.commit()
-    db.refresh(db_comment)
     return db_comment
 
 def get_comment(db: Session, comment_id: int) -> Comment | None:
     return db.query(Comment).filter(Comment.id == comment_id).first()
 
-def get_comment_by_dish(db: Session, dish: int, skip: int = 0, limit: int = 100, filtered:bool=True) -> List[Comment]:
-    return db.query(Comment).filter(Comment.dish_id == dish).filter(Comment.content_visible == filtered).offset(skip).limit(limit).all()
+def get_comment_by_dish(db: Session, dish: int, skip: int = 0, limit: int = 100, filtered:bool=True, cursor: str | None = None) -> Page[Comment]:
+    return keyset(db.query(Comment).filter(Comment.dish_id == dish).filter(Comment.content_visible == filtered), Comment.id, cursor, limit, skip)
 
 def delete(db: Session, comment_id: int):
-
-    item: Comment | None = db.query(Comment).filter(Comment.id == comment_id).first()
-    assert item, "No such comment"
-    db_dish: Dish | None = db.query(Dish).filter(Dish.id == item.dish_id).first()
-    assert db_dish, "No such dish"
-    if item.content:
-        db_dish.count_of_comments -= 1
-    db_dish.average_vote = (db_dish.average_vote * db_dish.count_of_votes - item.vote) / (db_dish.count_of_votes - 1)
-    db_dish.count_of_votes -= 1
-    db.delete(item)
+    canteens = _tally(db, comment_id, -1)
+    assert canteens is not None, "No such comment"
+    db.execute(sql_delete(Comment).where(Comment.id == comment_id))
+    _changed(db, canteens)
     db.commit()
     return True
 
 def update(db: Session, comment_id: int, comment: CommentItem):
+    # the old vote is taken back before the comment is changed, the new one counted after
+    old = _tally(db, comment_id, -1)
+    assert old is not None, "No such comment"
     db_comment: Comment | None = db.query(Comment).filter(Comment.id == comment_id).first()
-    assert db_comment, "No such comment"
-    original_vote = db_comment.vote
     db_comment.vote = comment.vote
-    db_dish: Dish | None = db.query(Dish).filter(Dish.id == comment.dish_id).first()
-    assert db_dish, "No such dish"
-    db_dish.average_vote = (db_dish.average_vote * db_dish.count_of_votes - original_vote + comment.vote) / db_dish.count_of_votes
     db_comment.content = comment.content
     db_comment.dish_id = comment.dish_id
+    db.flush()
+    _changed(db, old, _tally(db, comment_id, 1))
     db.commit()
-    db.refresh(comment_id)
     return db_comment
+
+def reconcile_ratings(db: Session) -> int:
+    """
+    Rebuild the ratings of all the dishes from the comments. Returns the number of dishes with comments.
+    """
+    db.execute(sql_delete(DishRating))
+    db.execute(insert(DishRating).from_select(
+        ["dish_id", "vote_sum", "vote_count", "comment_count"],
+        select(Comment.dish_id, func.sum(Comment.vote), func.count(), func.sum(case((_has_content(), 1), else_=0)))
+        .where(Comment.dish_id.in_(select(Dish.id)))
+        .group_by(Comment.dish_id),
+    ))
+    db.execute(sql_update(Dish).values(average_vote=DEFAULT_VOTE, count_of_votes=0, count_of_comments=0)
+               .execution_options(synchronize_session=False))
+    _derive(db)
+    versions.bump(db, "dishes")
+    db.commit()
+    return db.scalar(select(func.count()).select_from(DishRating))
+
+def ensure_ratings(db: Session) -> None:
+    """
+    Build the ratings if there are comments but no rating yet, i.e. on the first start after the ratings were added.
+    """
+    if db.scalar(select(DishRating.dish_id).limit(1)) is None and db.scalar(select(Comment.id).limit(1)) is not None:
+        reconcile_ratings(db)
@@ -1,8 +1,19 @@
 from typing import List
+from sqlalchemy import Row, delete as sql_delete, insert, select, update as sql_update
 from sqlalchemy.orm import Session
 
-from ..models import Dish
-from ..schemas import DishBase, DishItemUpdate, PricingData, AdvancedSearch
+from .. import pagination, sampling, search as fts, suggest, versions
+from ..models import Dish, DishRating, NewDish
+from ..schemas import DishBase, DishItemUpdate, PricingData, AdvancedSearch, MenuDiff
+
+
+def _changed(*canteens: int) -> None:
+    """
+    Tell the in-memory structures built from the dishes that dishes of these canteens were added, moved or deleted,
+    after the commit. Every change of the dishes also does a `versions.bump` before its commit.
+    """
+    for canteen in set(canteens):
+        sampling.invalidate(canteen)
 
 
 def get_all_by_canteen(db: Session, canteen: int, floor: int = 0, window: int = 0, name: str = '' , skip: int = 0, limit: int = 200) -> list[Dish]:
@@ -25,16 +36,108 @@ def add(db: Session, dish: DishBase) -> Dish:
                           measure=dish.measure,
                           )
     db.add(db_dish)
+    versions.bump(db, "dishes", dish.canteen)
     db.commit()
     db.refresh(db_dish)
+    _changed(db_dish.canteen)
+    suggest.add(db_dish)
     return db_dish
 
+def add_many(db: Session, dishes: list[DishBase]) -> list[Row]:
+    """
+    Insert all the dishes with one bulk statement in a single transaction.
+
+    Rows are returned instead of ORM objects, so that nothing has to be reloaded after the commit.
+    """
+    if not dishes:
+        return []
+    stmt = insert(Dish).returning(*Dish.__table__.c, sort_by_parameter_order=True)
+    ret = list(db.execute(stmt, [dish.model_dump() for dish in dishes]))
+    versions.bump(db, "dishes", *(dish.canteen for dish in dishes))
+    db.commit()
+    _changed(*(dish.canteen for dish in dishes))
+    for row in ret:
+        suggest.add(row)
+    return ret
+
+def upsert_many(db: Session, dishes: list[DishBase], retire_missing: bool = False, dry_run: bool = False) -> tuple[MenuDiff, list[Row]]:
+    """
+    Synchronize the dishes of the canteens in `dishes` with it, matching on (canteen, floor, window, name).
+
+    Only the new dishes are inserted and only the changed prices and measures are updated.
+    With `retire_missing`, the dishes of those canteens missing from `dishes` are deleted,
+    together with the duplicates of a natural key left by earlier imports.
+
+    :return: the diff and the inserted rows
+    """
+    incoming: dict[tuple, DishBase] = {}
+    for dish in dishes:
+        incoming[(dish.canteen, dish.floor, dish.window, dish.name)] = dish
+    existing = db.execute(
+        select(Dish.id, Dish.canteen, Dish.floor, Dish.window, Dish.name, Dish.price, Dish.measure)
+        .where(Dish.canteen.in_({dish.canteen for dish in incoming.values()}))
+        .order_by(Dish.id)
+    )
+    diff = MenuDiff(dry_run=dry_run)
+    seen: set[tuple] = set()
+    for row in existing:
+        key = (row.canteen, row.floor, row.window, row.name)
+        dish = incoming.get(key)
+        if dish is None or key in seen:
+            if retire_missing:
+                diff.retired.append(row.id)
+            continue
+        seen.add(key)
+        if dish.price == row.price and dish.measure == row.measure:
+            diff.unchanged += 1
+        else:
+            diff.updated.append(DishItemUpdate(id=row.id, **dish.model_dump()))
+    diff.inserted = [dish for key, dish in incoming.items() if key not in seen]
+    if dry_run:
+        return diff, []
+
+    if diff.updated:
+        db.execute(sql_update(Dish), [{"id": i.id, "price": i.price, "measure": i.measure} for i in diff.updated])
+        versions.bump(db, "dishes", *(dish.canteen for dish in diff.updated))
+    if diff.retired:
+        db.execute(sql_delete(NewDish).where(NewDish.dish_id.in_(diff.retired)))
+        db.execute(sql_delete(DishRating).where(DishRating.dish_id.in_(diff.retired)))
+        db.execute(sql_delete(Dish).where(Dish.id.in_(diff.retired)))
+        versions.bump(db, "dishes", *(dish.canteen for dish in incoming.values()))
+    inserted = add_many(db, diff.inserted)  # commits the whole synchronization
+    if not diff.inserted:
+        db.commit()
+    if diff.retired:
+        _changed(*(dish.canteen for dish in incoming.values()))
+        suggest.remove(*diff.retired)
+    return diff, inserted
+
 def get_by_id(db: Session, dish_id: int) -> Dish | None:
     return db.query(Dish).filter(Dish.id == dish_id).first()
 
+def get_random(db: Session, canteen: int, floor: int = 0, window: int = 0, weighting: sampling.Weighting = "uniform") -> Dish | None:
+    """
+    A random dish of a canteen, optionally of a floor and a window. See sql_app.sampling.
+    """
+    for _ in range(2):
+        dish_id = sampling.draw(db, canteen, floor, window, weighting)
+        if dish_id is None:
+            return None
+        ret = get_by_id(db, dish_id)
+        if ret is not None:
+            return ret
+        # deleted behind our back, draw again from a fresh pool
+        sampling.invalidate(canteen)
+    return None
+
 def delete(db: Session, dish_id: int) -> dict[str, str]:
-    db.query(Dish).filter(Dish.id == dish_id).delete()
+    canteens = db.scalars(sql_delete(Dish).where(Dish.id == dish_id).returning(Dish.canteen)).all()
+    db.execute(sql_delete(DishRating).where(DishRating.dish_id == dish_id))
+    if canteens:
+        versions.bump(db, "dishes", *canteens)
     db.commit()
+    _changed(*canteens)
+    suggest.remove(dish_id)
     return {"detail": "Delete Success"}
 
 def update_price(db: Session, dish_id: int, pricing: PricingData) -> Dish:
@@ -42,33 +145,39 @@ def update_price(db: Session, dish_id: int, pricing: PricingData) -> Dish:
     assert db_dish, "No such dish"
     db_dish.price = pricing.price
     db_dish.measure = pricing.measure
+    versions.bump(db, "dishes", db_dish.canteen)
     db.commit()
     return db_dish
 
 def update(db: Session, data: DishItemUpdate) -> Dish:
     db_dish: Dish | None = db.query(Dish).filter(Dish.id == data.id).first() if data.id else None
     assert db_dish, "No such dish"
+    moved = (db_dish.canteen, db_dish.floor, db_dish.window) != (data.canteen, data.floor, data.window)
+    old_canteen = db_dish.canteen
     db_dish.canteen = data.canteen
     db_dish.floor = data.floor
     db_dish.window = data.window
     db_dish.name = data.name
     db_dish.price = data.price if data.price else db_dish.price
     db_dish.measure = data.measure
+    versions.bump(db, "dishes", old_canteen, data.canteen)
     db.commit()
     db.refresh(db_dish)
+    if moved:
+        _changed(old_canteen, data.canteen)
+    suggest.add(db_dish)
     return db_dish
 
 def update_image(db: Session, dish_id: int, image: str) -> Dish:
     db_dish: Dish | None = db.query(Dish).filter(Dish.id == dish_id).first()
     assert db_dish, "No such dish"
     db_dish.image = image
+    versions.bump(db, "dishes", db_dish.canteen)
     db.commit()
     return db_dish
 
 def search(db: Session, name: str, skip: int = 0, limit: int = 200) -> List[Dish]:
-    return db.query(Dish).filter(Dish.name.like(
-        f"%{name}%"
-    )).offset(skip).limit(limit).all()
+    return fts.filter_by_name(db.query(Dish), name).offset(skip).limit(limit).all()
 
 def advanced_search(db: Session, data: AdvancedSearch):
     res = db.query(Dish)
@@ -80,5 +189,6 @@ def advanced_search(db: Session, data: AdvancedSearch):
     if data.window:
         res = res.filter(Dish.window.in_(data.window))
     if data.name:
-        res = res.filter(Dish.name.like(f"%{data.name}%"))
-    return res.offset(data.skip).limit(data.limit).all()
+        # ordered by relevance, which is no key to page on
+        return pagination.offset(fts.filter_by_name(res, data.name), data.cursor, data.limit, data.skip)
+    return pagination.keyset(res, Dish.id, data.cursor, data.limit, data.skip)
@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, not_
 from ..models import Feedback
+from ..pagination import Page, keyset
 from ..schemas import FeedbackCreate, FeedbackReplyCreate, FeedbackModify
 
 
@@ -59,23 +60,17 @@ def get_by_id(db: Session, fb_id: int):
     return db.query(Feedback).filter(Feedback.id == fb_id).first()
 
 
-def get_by_user(db: Session, uid: int, skip: int = 0, limit: int = 100):
-    return (
-        db.query(Feedback)
-        .filter(Feedback.user_id == uid)
-        .offset(skip)
-        .limit(limit=limit)
-        .all()
-    )
+def get_by_user(db: Session, uid: int, skip: int = 0, limit: int = 100, cursor: str | None = None) -> Page[Feedback]:
+    return keyset(db.query(Feedback).filter(Feedback.user_id == uid), Feedback.id, cursor, limit, skip)
 
 
-def get_by_target(db: Session, tid: int, filter_replied: bool | None = None, skip: int = 0, limit: int = 100):
+def get_by_target(db: Session, tid: int, filter_replied: bool | None = None, skip: int = 0, limit: int = 100, cursor: str | None = None) -> Page[Feedback]:
     r = db.query(Feedback).filter(Feedback.towards == tid)
     # no filter, return all
     if filter_replied is None:
-        return r.offset(skip).limit(limit).all()
+        return keyset(r, Feedback.id, cursor, limit, skip)
 
     if filter_replied:
-        return r.filter(not_(Feedback.content == None)).offset(skip).limit(limit).all()
+        return keyset(r.filter(not_(Feedback.content == None)), Feedback.id, cursor, limit, skip)
     # filter non-replied ones
-    return r.filter(Feedback.content == None).offset(skip).limit(limit).all()
+    return keyset(r.filter(Feedback.content == None), Feedback.id, cursor, limit, skip)
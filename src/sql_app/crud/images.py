@@ -0,0 +1,31 @@
+"""
+The images referenced by the rows, for finding the objects of the bucket that nothing uses.
+
+An image column holds an object name or a URL ending with it, possibly with a query
+(e.g. `.../static/get/<name>?variant=thumb`): the name is its last path segment.
+"""
+
+from sqlalchemy import case, func, select, union_all
+from sqlalchemy.orm import Session
+
+from ..models import Canteen, Carousel, Dish, User
+
+IMAGE_COLUMNS = (Dish.image, Carousel.image, User.image, Canteen.image, Canteen.icon)
+
+
+def _object_name(column):
+    # rtrim by all the characters but "/" leaves what is up to the last "/"
+    tail = func.substr(column, func.length(func.rtrim(column, func.replace(column, "/", ""))) + 1)
+    query = func.instr(tail, "?")
+    return case((query > 0, func.substr(tail, 1, query - 1)), else_=tail)
+
+
+def referenced(db: Session, names: set[str]) -> set[str]:
+    """
+    Those of the object names which an image column refers to.
+    Each table is scanned once per call, so the names are given by pages.
+    """
+    if not names:
+        return set()
+    images = union_all(*(select(_object_name(c).label("name")).where(c.is_not(None)) for c in IMAGE_COLUMNS)).subquery()
+    return set(db.scalars(select(images.c.name).where(images.c.name.in_(list(names))).distinct()))
@@ -1,6 +1,9 @@
-from ..schemas import MarkCreate, MarkData
+from ..schemas import MarkCreate
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from ..models import Mark, Dish
+from .. import counters
+from ..pagination import Page, keyset
 
 def add(db: Session, mark: MarkCreate):
     db_mark = Mark(
@@ -8,14 +11,14 @@ def add(db: Session, mark: MarkCreate):
         dish_id = mark.dish_id,
         time = mark.time,
     )
-    db.query(Dish).filter(Dish.id == mark.dish_id).update({"count_of_mark": Dish.count_of_mark + 1})
     db.add(db_mark)
     db.commit()
-    db.refresh(db_mark)
+    # the count of the dish is written behind, see sql_app.counters
+    counters.add("count_of_mark", mark.dish_id, 1)
     return db_mark
 
-def get_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(Mark).filter(Mark.user_id == user_id).offset(skip).limit(limit=limit).all()
+def get_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100, cursor: str | None = None) -> Page[Mark]:
+    return keyset(db.query(Mark).filter(Mark.user_id == user_id), Mark.id, cursor, limit, skip)
 def get_by_id(db: Session, mark_id: int):
     return db.query(Mark).filter(Mark.id == mark_id).first()
 
@@ -27,9 +30,33 @@ def delete(db: Session, mark_id: int, uid: int):
         raise ValueError('Unauthorized')
     dish_id = k.dish_id
     db.delete(k)
-    db.query(Dish).filter(Dish.id == dish_id).update({"count_of_mark": Dish.count_of_mark - 1})
     db.commit()
+    counters.add("count_of_mark", dish_id, -1)
     return True
 
-def get_by_dish(db: Session, dish_id: int, skip: int = 0, limit: int = 100):
-    return db.query(Mark).filter(Mark.dish_id == dish_id).offset(skip).limit(limit=limit).count()
\ No newline at end of file
+def get_by_dish(db: Session, dish_id: int) -> int:
+    """
+    The exact number of marks of a dish, counted on the index of Mark.dish_id.
+    """
+    return db.scalar(select(func.count()).select_from(Mark).where(Mark.dish_id == dish_id))
+
+def count_by_dish(db: Session, dish_id: int) -> int | None:
+    """
+    The number of marks of a dish from its maintained count_of_mark, None if there is no such dish.
+    """
+    stored = db.execute(select(Dish.count_of_mark).where(Dish.id == dish_id)).first()
+    if stored is None:
+        return None
+    return counters.value("count_of_mark", dish_id, stored[0])
+
+def get_dishes_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100, cursor: str | None = None) -> Page:
+    """
+    The dishes marked by a user with the id and time of the marks, latest marks last, in one joined query:
+    the marks of the user are read on the index of Mark.user_id, their dishes by primary key.
+    """
+    query = (
+        db.query(*Dish.__table__.c, Mark.id.label("mark_id"), Mark.time.label("marked_at"))
+        .join(Dish, Dish.id == Mark.dish_id)
+        .filter(Mark.user_id == user_id)
+    )
+    return keyset(query, Mark.id, cursor, limit, skip, label="mark_id")
@@ -1,7 +1,7 @@
-from typing import List, Tuple
-from sqlalchemy.engine.row import Row
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from .. import versions
 from ..models import Dish, NewDish
 
 
@@ -11,6 +11,8 @@ def get(db: Session, canteen: int):
 
 def delete(db: Session, dish_id: int):
     db.query(NewDish).filter(NewDish.dish_id == dish_id).delete()
+    canteen = db.scalar(select(Dish.canteen).where(Dish.id == dish_id))
+    versions.bump(db, "new", canteen)
     db.commit()
     return {
         "status": "success"
@@ -22,6 +24,7 @@ def add(db: Session, dish_id: int) -> Dish | None:
         db.add(NewDish(
             dish_id=dish_id
         ))
+        versions.bump(db, "new", db_dish.canteen)
     db.commit()
     db.refresh(db_dish)
     return db_dish
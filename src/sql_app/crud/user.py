@@ -1,7 +1,18 @@
 from sql_app.schemas import UserData
+from ..cache import TTLCache, cached
 from ..models import User, Admin
 from sqlalchemy.orm import Session
 
+# Short TTL: the users are looked up by every authenticated request
+user_cache = TTLCache("user", maxsize=4096, ttl=30)
+
+def _detached(db_user: User | None) -> User | None:
+    # a transient copy, which does not belong to the session of the request that loaded it
+    if db_user is None:
+        return None
+    return User(id=db_user.id, username=db_user.username, sdu_id=db_user.sdu_id, is_admin=db_user.is_admin, image=db_user.image)
+
+@cached(user_cache, _detached)
 def get_user(db: Session, id: int) -> User | None:
     return db.query(User).filter(User.id == id).first()
 
@@ -29,6 +40,7 @@ def register_user(db: Session, username: str, sdu_id: str | None, is_admin: bool
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(("get_user", db_user.id))
     return db_user
 
 def update_user_image(db: Session, user_id: int, image: str) -> User:
@@ -38,6 +50,7 @@ def update_user_image(db: Session, user_id: int, image: str) -> User:
     db_user.image = image
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(("get_user", user_id))
     return db_user
 
 def update_user(db: Session, user_id: int, data: UserData) -> User:
@@ -49,4 +62,5 @@ def update_user(db: Session, user_id: int, data: UserData) -> User:
     db_user.is_admin = data.is_admin
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(("get_user", user_id))
     return db_user
@@ -1,10 +1,129 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import Engine, create_engine, event, make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL", "sqlite:///./sql_app.db")
+# "sync": the routes run the crud functions in the threadpool with a Session.
+# "async": they run them with an AsyncSession on aiosqlite, without tying up threads.
+DB_MODE = os.getenv("DB_MODE", "sync")
+# The pragmas set on every SQLite connection, see PROFILES.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "wal")
+# Connections of the read-write pool. SQLite has a single writer at a time, more connections only queue on its lock.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Connections of the read-only pool. In WAL mode readers do not block each other nor the writer,
+# so it is sized for the 40 threads of the threadpool.
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "20"))
+READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "20"))
+
+PROFILES: dict[str, dict[str, str | int]] = {
+    # SQLite's defaults: rollback journal, a reader blocks the writer and the other way round.
+    "default": {},
+    "wal": {
+        # readers see the last commit while a write is running
+        "journal_mode": "WAL",
+        # in WAL mode, a commit is durable once the WAL is checkpointed instead of synced on every commit
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        # in KiB when negative
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+        # wait for the lock instead of failing with "database is locked"
+        "busy_timeout": 5000,
+    },
+}
+# Only apply to the database file, they are set by the read-write connections.
+_WRITER_PRAGMAS = {"journal_mode", "synchronous"}
+
+if SQLITE_PROFILE not in PROFILES:
+    raise ValueError(f"SQLITE_PROFILE should be one of {', '.join(PROFILES)}, not {SQLITE_PROFILE}")
+if DB_MODE not in ("sync", "async"):
+    raise ValueError(f"DB_MODE should be sync or async, not {DB_MODE}")
+
+
+def sqlite_file(url: str) -> str | None:
+    """
+    The path of the database file, None if the URL is not an SQLite file.
+    """
+    u = make_url(url)
+    if u.get_backend_name() != "sqlite" or u.database in (None, "", ":memory:") or u.query.get("uri"):
+        return None
+    return u.database
+
+
+def read_only_url(url: str) -> str | None:
+    path = sqlite_file(url)
+    if path is None:
+        return None
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+
+def set_pragmas(engine: Engine, profile: str, read_only: bool = False) -> None:
+    """
+    Set the pragmas of the profile on every new connection of the engine.
+    """
+    pragmas = {k: v for k, v in PROFILES[profile].items() if not (read_only and k in _WRITER_PRAGMAS)}
+    if read_only:
+        pragmas["query_only"] = "ON"
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def create_engines(url: str, profile: str = SQLITE_PROFILE, is_async: bool = False):
+    """
+    The read-write engine and the read-only engine of a database.
+    The read-only engine is the read-write one when the database is not an SQLite file.
+    """
+    ro_url = read_only_url(url)
+    if is_async:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+        url = url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        ro_url = ro_url and ro_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        create, poolclass, connect_args = create_async_engine, AsyncAdaptedQueuePool, {}
+    else:
+        create, poolclass, connect_args = create_engine, QueuePool, {"check_same_thread": False}
+
+    if ro_url is None:
+        # in-memory SQLite keeps the default pool of its dialect, whose connections share the database
+        writer = create(url, connect_args=connect_args)
+        if make_url(url).get_backend_name() == "sqlite":
+            set_pragmas(getattr(writer, "sync_engine", writer), profile)
+        return writer, writer
+
+    writer = create(
+        url, connect_args=connect_args, poolclass=poolclass, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW
+    )
+    reader = create(
+        ro_url, connect_args=connect_args, poolclass=poolclass, pool_size=READ_POOL_SIZE, max_overflow=READ_MAX_OVERFLOW
+    )
+    set_pragmas(getattr(writer, "sync_engine", writer), profile)
+    set_pragmas(getattr(reader, "sync_engine", reader), profile, read_only=True)
+    return writer, reader
+
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
+# Objects are not expired on commit, so returning them does not reload them during serialization.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=read_engine)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import async_sessionmaker
 
+    async_engine, async_read_engine = create_engines(SQLALCHEMY_DATABASE_URL, is_async=True)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
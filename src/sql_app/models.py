@@ -5,7 +5,7 @@ The models of the database using SQLAlchemy ORM
 import datetime
 import decimal
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, Numeric, String, Text
+from sqlalchemy import Boolean, DateTime, ForeignKey, Index, Integer, Numeric, String, Text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -57,6 +57,10 @@ class Comment(Base):  # This class is to be used in the future
     """
 
     __tablename__ = "comments"
+    __table_args__ = (
+        # The comments of a dish shown to everyone, paged by id (implicitly the last column of the index).
+        Index("ix_comments_dish_visible", "dish_id", "content_visible"),
+    )
 
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, index=True, autoincrement=True
@@ -121,6 +125,10 @@ class Dish(Base):
     """
 
     __tablename__ = "dishes"
+    __table_args__ = (
+        # The natural key of a dish, used to match the dishes of a re-imported menu.
+        Index("ix_dishes_natural_key", "canteen", "floor", "window", "name"),
+    )
 
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, index=True, autoincrement=True
@@ -146,6 +154,32 @@ class Dish(Base):
     count_of_mark: Mapped[int] = mapped_column(Integer, default=0)
 
 
+class DishRating(Base):
+    """
+    The votes of a dish aggregated from its comments, updated in SQL by the comment writes.
+    average_vote, count_of_votes and count_of_comments of the dish are derived from it.
+    """
+
+    __tablename__ = "dish_ratings"
+
+    dish_id: Mapped[int] = mapped_column(Integer, ForeignKey("dishes.id"), primary_key=True)
+    vote_sum: Mapped[decimal.Decimal] = mapped_column(Numeric, default=0)
+    vote_count: Mapped[int] = mapped_column(Integer, default=0)
+    comment_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ListVersion(Base):
+    """
+    The version of the data behind a polled list, see sql_app.versions.
+    `scope` is a table ("canteens") or the part of a table about a canteen ("dishes/3").
+    """
+
+    __tablename__ = "list_versions"
+
+    scope: Mapped[str] = mapped_column(String(32), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
 class NewDish(Base):
     __tablename__ = "new_dishes"
 
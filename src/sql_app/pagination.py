@@ -0,0 +1,94 @@
+"""
+Cursor pagination of the lists.
+
+With `offset(skip)`, SQLite reads and drops all the skipped rows, so a page gets slower the deeper
+it is. A cursor holds the id of the last row of the previous page instead, and the next page
+is read from there on the index (an index on a column of an SQLite table also orders its rows
+by rowid, which is the integer id).
+
+Cursors are opaque to the clients: they are given in the X-Next-Cursor header of a page,
+absent on the last page, and sent back as the `cursor` parameter. `skip` keeps working.
+"""
+
+import base64
+import json
+
+from sqlalchemy.orm import InstrumentedAttribute, Query
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(list):
+    """
+    The rows of a page, with the cursor of the next page (None on the last page).
+    """
+
+    next_cursor: str | None = None
+
+
+def encode(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode(cursor: str) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor("Invalid cursor") from None
+    if not isinstance(state, dict):
+        raise InvalidCursor("Invalid cursor")
+    return state
+
+
+def _page(rows: list, limit: int, next_state) -> Page:
+    page = Page(rows[:limit])
+    if page and len(rows) > limit:
+        page.next_cursor = encode(next_state(page[-1]))
+    return page
+
+
+def keyset(
+    query: Query, key: InstrumentedAttribute, cursor: str | None, limit: int, skip: int = 0, label: str | None = None
+) -> Page:
+    """
+    A page of the query ordered by `key`, an indexed unique column, after the row of the cursor.
+    Without a cursor, the page starts after `skip` rows.
+
+    :param label: the name of the key in the rows, if it is not the name of the column
+    """
+    query = query.order_by(key)
+    if cursor is not None:
+        after = decode(cursor).get("k")
+        if not isinstance(after, int):
+            raise InvalidCursor("Invalid cursor")
+        query = query.filter(key > after)
+    elif skip:
+        query = query.offset(skip)
+    # one more row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    return _page(rows, limit, lambda last: {"k": getattr(last, label or key.key)})
+
+
+def offset(query: Query, cursor: str | None, limit: int, skip: int = 0) -> Page:
+    """
+    Pagination of an ordering without a usable key, e.g. by relevance: the cursor holds the offset.
+    """
+    if cursor is not None:
+        skip = decode(cursor).get("o")
+        if not isinstance(skip, int) or skip < 0:
+            raise InvalidCursor("Invalid cursor")
+    rows = query.offset(skip).limit(limit + 1).all()
+    return _page(rows, limit, lambda last: {"o": skip + limit})
+
+
+def with_cursor(response, page: Page) -> Page:
+    """
+    Put the cursor of the next page in the headers of the response.
+    """
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page
@@ -0,0 +1,111 @@
+"""
+Random dish selection without loading the dishes.
+
+For every (canteen, floor, window) asked for, a compact array of dish ids, and the
+cumulative weights when the draw is weighted, is kept in memory. A draw is then a
+bisect on that array and only the chosen dish is fetched from the database.
+
+The arrays are built lazily and dropped by `invalidate` whenever dishes of a canteen
+are added, moved or deleted (see sql_app.crud.dishes). That only happens in the process
+which changed the dishes, so the arrays of the other workers are rebuilt after POOL_TTL.
+"""
+
+import bisect
+import os
+import random
+import threading
+import time
+from array import array
+from itertools import accumulate
+from typing import Literal
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import counters
+from .models import Dish
+
+Weighting = Literal["uniform", "average_vote", "count_of_mark"]
+
+# Seconds after which a pool is rebuilt: the other workers do not see the invalidations of a
+# process, and votes and marks change the weights without any invalidation.
+POOL_TTL = float(os.getenv("SAMPLING_POOL_TTL", "60"))
+MIN_VOTE_WEIGHT = 0.1
+
+
+class _Pool:
+    __slots__ = ("ids", "cum_weights", "built")
+
+    def __init__(self, ids: array, cum_weights: array | None):
+        self.ids = ids
+        self.cum_weights = cum_weights
+        self.built = time.monotonic()
+
+
+_pools: dict[tuple[int, int, int, str], _Pool] = {}
+_lock = threading.Lock()
+# bumped by every invalidation, so that a pool built before it is not kept after it
+_generation = 0
+
+
+def _weight(weighting: Weighting, value) -> float:
+    if weighting == "count_of_mark":
+        # every dish keeps a chance to be drawn, even if nobody has marked it yet
+        return float(value or 0) + 1.0
+    return max(float(value if value is not None else 0), MIN_VOTE_WEIGHT)
+
+
+def _build(db: Session, canteen: int, floor: int, window: int, weighting: Weighting) -> _Pool:
+    stmt = select(Dish.id).where(Dish.canteen == canteen)
+    if floor:
+        stmt = stmt.where(Dish.floor == floor)
+    if window:
+        stmt = stmt.where(Dish.window == window)
+    if weighting == "uniform":
+        return _Pool(array("q", db.scalars(stmt)), None)
+    ids = array("q")
+    weights = []
+    rows = db.execute(stmt.add_columns(getattr(Dish, weighting))).all()
+    if weighting in counters.COLUMNS:
+        rows = counters.merge(weighting, rows)
+    for dish_id, value in rows:
+        ids.append(dish_id)
+        weights.append(_weight(weighting, value))
+    return _Pool(ids, array("d", accumulate(weights)))
+
+
+def draw(db: Session, canteen: int, floor: int = 0, window: int = 0, weighting: Weighting = "uniform") -> int | None:
+    """
+    Draw the id of a random dish of a canteen, optionally restricted to a floor and a window.
+
+    :return: the id of the dish, None if there is no dish to draw from
+    """
+    key = (canteen, floor, window, weighting)
+    pool = _pools.get(key)
+    if pool is None or time.monotonic() - pool.built > POOL_TTL:
+        with _lock:
+            generation = _generation
+        pool = _build(db, canteen, floor, window, weighting)
+        with _lock:
+            if generation == _generation:
+                _pools[key] = pool
+    if not pool.ids:
+        return None
+    if pool.cum_weights is None:
+        return pool.ids[random.randrange(len(pool.ids))]
+    i = bisect.bisect_right(pool.cum_weights, random.random() * pool.cum_weights[-1])
+    return pool.ids[min(i, len(pool.ids) - 1)]
+
+
+def invalidate(canteen: int | None = None) -> None:
+    """
+    Drop the pools of a canteen, or all the pools if canteen is None.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        if canteen is None:
+            _pools.clear()
+            return
+        for key in [key for key in _pools if key[0] == canteen]:
+            del _pools[key]
@@ -1,5 +1,6 @@
 import decimal
-from pydantic import BaseModel
+from typing import Generic, TypeVar
+from pydantic import BaseModel, Field
 
 from datetime import datetime
 
@@ -92,6 +93,19 @@ class CarouselItem(BaseModel):
     image: str | None = None
 
 
+class CarouselStored(CarouselItem):
+    """
+    CarouselStored is the class for a carousel item stored in the database.
+
+    Attributes:
+    id: int
+    canteen: int
+    image: str | None = None
+    """
+
+    id: int
+
+
 class CommentItem(BaseModel):
     """
     CommentItem is the class for a comment item.
@@ -155,6 +169,7 @@ class AdvancedSearch(BaseModel):
     floor: int | None = None
     window: int | None = None
     name: str | None = None
+    cursor: str | None = None, the X-Next-Cursor of the previous page
     """
 
     canteen: list[int] = []
@@ -162,7 +177,8 @@ class AdvancedSearch(BaseModel):
     window: list[int] = []
     name: str = ""
     skip: int = 0
-    limit: int = 200
+    limit: int = Field(200, ge=1)
+    cursor: str | None = None
 
 
 class UserData(BaseModel):
@@ -173,6 +189,16 @@ class UserData(BaseModel):
     image: str | None = None
 
 
+class UserPublic(BaseModel):
+    """
+    UserPublic is what any user may see of another user.
+    """
+
+    id: int
+    username: str
+    image: str | None = None
+
+
 class AdminCreate(BaseModel):
     access_name: str
     password: str
@@ -219,6 +245,19 @@ class MarkData(MarkCreate):
     id: int
 
 
+class MarkedDish(DishItem):
+    """
+    MarkedDish is a dish marked by a user.
+
+    Attributes:
+    mark_id: int
+    marked_at: datetime
+    """
+
+    mark_id: int
+    marked_at: datetime
+
+
 class FloorData(BaseModel):
     canteen: int
     floor: int
@@ -230,3 +269,89 @@ class FloorStored(BaseModel):
     canteen: int
     floor_in_canteen: int
     count_of_windows: int
+
+
+class MenuDiff(BaseModel):
+    """
+    MenuDiff is the difference between an uploaded menu and the dishes in the database.
+
+    Dishes are matched on (canteen, floor, window, name).
+
+    Attributes:
+    inserted: list[DishBase], the dishes not in the database yet
+    updated: list[DishItemUpdate], the dishes whose price or measure changed, with the new values
+    retired: list[int], the ids of the dishes removed because they are missing from the menu
+    unchanged: int
+    dry_run: bool, if True, nothing has been written
+    """
+
+    inserted: list[DishBase] = []
+    updated: list[DishItemUpdate] = []
+    retired: list[int] = []
+    unchanged: int = 0
+    dry_run: bool = False
+
+
+class ExcelRowError(BaseModel):
+    """
+    ExcelRowError describes why a row of an uploaded Excel sheet is rejected.
+
+    Attributes:
+    row: int, the row number as shown by Excel (the header is row 1)
+    column: str | None
+    detail: str
+    """
+
+    row: int
+    column: str | None = None
+    detail: str
+
+
+class ExcelImportResult(BaseModel):
+    """
+    ExcelImportResult is the result of importing an Excel sheet of dishes.
+
+    Attributes:
+    imported: int, the number of dishes written to the database
+    dishes: list[DishItem]
+    errors: list[ExcelRowError]
+    elapsed: float, seconds spent on the import
+    rows_per_second: float
+    diff: MenuDiff | None, set when the sheet is imported in upsert mode
+    """
+
+    imported: int
+    dishes: list[DishItem] = []
+    errors: list[ExcelRowError] = []
+    elapsed: float
+    rows_per_second: float
+    diff: MenuDiff | None = None
+
+
+# The most ids a batch get may ask for
+MAX_BATCH = 300
+T = TypeVar("T")
+
+
+class BatchQuery(BaseModel):
+    """
+    BatchQuery is the list of ids of a batch get.
+
+    Attributes:
+    ids: list[int], at most MAX_BATCH, a repeated id is resolved once
+    """
+
+    ids: list[int] = Field(max_length=MAX_BATCH)
+
+
+class BatchResult(BaseModel, Generic[T]):
+    """
+    BatchResult is the result of a batch get.
+
+    Attributes:
+    items: list[T], the items found, in the order of the ids asked for
+    missing: list[int], the ids asked for which were not found
+    """
+
+    items: list[T]
+    missing: list[int]
@@ -0,0 +1,133 @@
+"""
+Full-text search on the names of the dishes, using an SQLite FTS5 index.
+
+FTS5's unicode61 tokenizer keeps a run of Chinese characters as a single token, so
+"宫保鸡丁" could only be found by its full name. The names are therefore segmented
+before being indexed: every CJK character is a token of its own and runs of
+letters and digits are words. A query is segmented the same way and searched as a
+phrase, which finds any substring of a Chinese name while still using the index.
+
+The index `dishes_fts` is kept in sync with `dishes` by triggers calling the SQL
+function `cjk_segment`, which is registered on every connection of the engine.
+Writing to `dishes` from a connection without it (e.g. the sqlite3 shell) fails.
+
+When FTS5 is not available, searches fall back to LIKE.
+"""
+
+import unicodedata
+
+from sqlalchemy import Engine, event, exc, false, literal_column, select, text
+from sqlalchemy.orm import Query
+
+from .models import Dish
+
+FTS_TABLE = "dishes_fts"
+enabled = False
+
+
+def _is_cjk(char: str) -> bool:
+    return (
+        "\u3400" <= char <= "\u9fff"
+        or "\uf900" <= char <= "\ufaff"
+        or "\U00020000" <= char <= "\U0003134f"
+    )
+
+
+def segment(name: str | None) -> str:
+    """
+    Split a name into space separated tokens: one per CJK character, one per word otherwise.
+    """
+    if not name:
+        return ""
+    tokens: list[str] = []
+    word = ""
+    for char in unicodedata.normalize("NFKC", name).lower():
+        if _is_cjk(char) or not char.isalnum():
+            if word:
+                tokens.append(word)
+                word = ""
+            if _is_cjk(char):
+                tokens.append(char)
+        else:
+            word += char
+    if word:
+        tokens.append(word)
+    return " ".join(tokens)
+
+
+def match_expression(s: str) -> str:
+    """
+    The FTS5 query for a search string: a phrase of its tokens, the last one being a prefix.
+    """
+    tokens = segment(s)
+    return f'"{tokens}" *' if tokens else ""
+
+
+def register_functions(engine: Engine) -> None:
+    """
+    Register `cjk_segment` on every new connection of the engine. Must be called before the engine is used.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function("cjk_segment", 1, segment, deterministic=True)
+
+
+def create_index(engine: Engine) -> None:
+    """
+    Create the FTS index and its triggers if they do not exist, and fill the index when it is new.
+    """
+    global enabled
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        if not exists:
+            try:
+                conn.execute(text(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(tokens, tokenize = 'unicode61')"))
+            except exc.OperationalError:
+                print("Warning: SQLite is built without FTS5, dish search falls back to LIKE")
+                return
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, tokens) SELECT id, cjk_segment(name) FROM dishes"))
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_insert AFTER INSERT ON dishes BEGIN
+                INSERT INTO {FTS_TABLE}(rowid, tokens) VALUES (new.id, cjk_segment(new.name));
+            END"""))
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_delete AFTER DELETE ON dishes BEGIN
+                DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+            END"""))
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_update AFTER UPDATE OF name ON dishes BEGIN
+                UPDATE {FTS_TABLE} SET tokens = cjk_segment(new.name) WHERE rowid = new.id;
+            END"""))
+    enabled = True
+
+
+def filter_by_name(query: Query, name: str) -> Query:
+    """
+    Keep the dishes of the query whose name contains `name`, the most relevant and best voted first.
+    """
+    if not enabled:
+        return query.filter(Dish.name.like(f"%{name}%"))
+    expression = match_expression(name)
+    if not expression:
+        # only punctuation or spaces, e.g. "!!!": no token to match, and LIKE found no such name either
+        return query if not name else query.filter(false())
+    matches = (
+        select(
+            literal_column("rowid").label("dish_id"),
+            literal_column(f"bm25({FTS_TABLE})").label("rank"),
+        )
+        .select_from(text(FTS_TABLE))
+        .where(text(f"{FTS_TABLE} MATCH :expression").bindparams(expression=expression))
+        .subquery()
+    )
+    return query.join(matches, Dish.id == matches.c.dish_id).order_by(
+        matches.c.rank, Dish.average_vote.desc(), Dish.id
+    )
@@ -0,0 +1,173 @@
+"""
+In-memory prefix index of the dish names, for autocompletion.
+
+Every name is reachable through its lowercased name and, when pypinyin is installed,
+through its full pinyin ("gongbaojiding") and its initials ("gbjd"). Every node of
+the trie keeps its TOP_K most popular names, so a suggestion is a walk down the
+prefix and a slice, without touching the database.
+
+The trie is built at startup from the `dishes` table and kept up to date by
+sql_app.crud.dishes. Popularity (marks and votes) is only refreshed by a rebuild, which
+the app runs every REBUILD_INTERVAL seconds.
+"""
+
+import os
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Dish
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pinyin keys are optional
+    lazy_pinyin = None
+
+TOP_K = 20
+# Seconds between the rebuilds which refresh the popularity of the names
+REBUILD_INTERVAL = float(os.getenv("SUGGEST_REBUILD_INTERVAL", "300"))
+
+
+class _Node:
+    __slots__ = ("children", "top", "names")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.top: list[tuple[float, str]] = []  # the most popular names below this node, most popular first
+        self.names: set[str] = set()  # the names with a key ending at this node
+
+
+_root = _Node()
+# the trie read by suggest: the previous one while a rebuild fills _root
+_published = _root
+_dishes: dict[int, tuple[str, float]] = {}  # dish id -> (name, weight)
+_weights: dict[str, tuple[float, int]] = {}  # name -> (total weight, count of dishes)
+_lock = threading.RLock()
+built = False
+
+
+def _keys(name: str) -> set[str]:
+    keys = {name.strip().lower()}
+    if lazy_pinyin is not None:
+        keys.add("".join(lazy_pinyin(name)).lower())
+        keys.add("".join(lazy_pinyin(name, style=Style.FIRST_LETTER)).lower())
+    keys.discard("")
+    return keys
+
+
+def _weight(count_of_mark: int | None, count_of_votes: int | None) -> float:
+    return float((count_of_mark or 0) + (count_of_votes or 0) + 1)
+
+
+def _path(key: str, create: bool, root: _Node | None = None) -> list[_Node]:
+    nodes = [_root if root is None else root]
+    for char in key:
+        node = nodes[-1].children.get(char)
+        if node is None:
+            if not create:
+                return []
+            node = nodes[-1].children[char] = _Node()
+        nodes.append(node)
+    return nodes
+
+
+def _rebuild_top(node: _Node) -> None:
+    found: dict[str, float] = {}
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        for name in n.names:
+            found[name] = _weights[name][0]
+        stack.extend(n.children.values())
+    node.top = sorted(((w, name) for name, w in found.items()), key=lambda x: (-x[0], x[1]))[:TOP_K]
+
+
+def _index_name(name: str, weight: float) -> None:
+    for key in _keys(name):
+        nodes = _path(key, create=True)
+        nodes[-1].names.add(name)
+        for node in nodes:
+            top = [entry for entry in node.top if entry[1] != name]
+            top.append((weight, name))
+            top.sort(key=lambda x: (-x[0], x[1]))
+            node.top = top[:TOP_K]
+
+
+def _unindex_name(name: str) -> None:
+    # the name leaves the nodes of all its keys before any top list is rebuilt, which reads the weights
+    # of the names left below the nodes: the name may already have no weight
+    paths = [nodes for nodes in (_path(key, create=False) for key in _keys(name)) if nodes]
+    for nodes in paths:
+        nodes[-1].names.discard(name)
+    for nodes in paths:
+        for node in nodes:
+            if any(entry[1] == name for entry in node.top):
+                _rebuild_top(node)
+
+
+def _add(dish_id: int, name: str, weight: float) -> None:
+    _dishes[dish_id] = (name, weight)
+    total, count = _weights.get(name, (0.0, 0))
+    _weights[name] = (total + weight, count + 1)
+    _index_name(name, total + weight)
+
+
+def _remove(dish_id: int) -> None:
+    entry = _dishes.pop(dish_id, None)
+    if entry is None:
+        return
+    name, weight = entry
+    total, count = _weights[name]
+    if count == 1:
+        _unindex_name(name)
+        del _weights[name]
+    else:
+        _weights[name] = (total - weight, count - 1)
+        # the weight of the name has decreased, so it may have to leave some top lists
+        _unindex_name(name)
+        _index_name(name, total - weight)
+
+
+def build(db: Session) -> None:
+    """
+    (Re)build the trie from the dishes table. Suggestions are answered from the previous trie until it is done.
+    """
+    global _root, _published, built
+    rows = db.execute(select(Dish.id, Dish.name, Dish.count_of_mark, Dish.count_of_votes)).all()
+    with _lock:
+        _root = _Node()
+        _dishes.clear()
+        _weights.clear()
+        for dish_id, name, count_of_mark, count_of_votes in rows:
+            _add(dish_id, name, _weight(count_of_mark, count_of_votes))
+        _published = _root
+        built = True
+
+
+def add(dish: Dish) -> None:
+    """
+    Index a new dish, or re-index a dish whose name changed.
+    """
+    with _lock:
+        _remove(dish.id)
+        _add(dish.id, dish.name, _weight(dish.count_of_mark, dish.count_of_votes))
+
+
+def remove(*dish_ids: int) -> None:
+    with _lock:
+        for dish_id in dish_ids:
+            _remove(dish_id)
+
+
+def suggest(prefix: str, k: int = 10) -> list[str]:
+    """
+    The k most popular dish names with a key starting with prefix.
+    """
+    prefix = prefix.strip().lower()
+    if not prefix:
+        return []
+    nodes = _path(prefix, create=False, root=_published)
+    if not nodes:
+        return []
+    return [name for _, name in nodes[-1].top[:k]]
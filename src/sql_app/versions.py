@@ -0,0 +1,47 @@
+"""
+Version counters of the data behind the polled lists, for their ETags.
+
+Every write in sql_app.crud bumps the version of what it changed, in the transaction of the change:
+a table (`bump(db, "canteens")`) or the part of a table about some canteens
+(`bump(db, "dishes", canteen)`). The ETag of a list is made of the versions it depends on,
+read with one query on the primary key instead of the list itself, and changes whenever the list
+may have changed.
+
+The versions are rows of `list_versions`, so that a write handled by a worker changes the tags of
+all the workers. The tag is read before the list: a write committed in between makes the response
+newer than its tag, which is only revalidated once more.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .models import ListVersion
+
+
+def _scope(table: str, canteen: int | None = None) -> str:
+    return table if canteen is None else f"{table}/{canteen}"
+
+
+def bump(db: Session, table: str, *canteens: int | None) -> None:
+    """
+    Bump the versions of the canteens in a table, or of the whole table without canteens.
+    Committed with the changes of the session.
+    """
+    scopes = sorted({_scope(table, canteen) for canteen in canteens}) if canteens else [_scope(table)]
+    stmt = insert(ListVersion)
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=[ListVersion.scope], set_={"version": ListVersion.version + 1}),
+        [{"scope": scope, "version": 1} for scope in scopes],
+    )
+
+
+def etag(db: Session, *scopes: tuple) -> str:
+    """
+    The strong ETag of data depending on the scopes, each being (table,) or (table, canteen).
+    A change of the whole table changes the tags of all its canteens.
+    """
+    names = {_scope(*scope) for scope in scopes} | {scope[0] for scope in scopes}
+    found = dict(db.execute(select(ListVersion.scope, ListVersion.version).where(ListVersion.scope.in_(names))).all())
+    parts = [f"{found.get(scope[0], 0)}.{found.get(_scope(*scope), 0) if len(scope) > 1 else 0}" for scope in scopes]
+    return f'"v{"-".join(parts)}"'
@@ -1,14 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import Annotated
 from sql_app.models import User, Admin
-from sql_app import get_db
-from sql_app.schemas import UserData, AdminCreate, AdminData
-from sql_app.crud import user
+from sql_app import ReadSessionLocal, get_db, get_read_session, get_session
+from sql_app.schemas import UserData, UserPublic, AdminCreate, AdminData, BatchQuery, BatchResult
+from sql_app.crud import aio, batch, user
 from passlib.context import CryptContext
 import jwt
 import sdu_sso
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import timedelta, datetime
+import asyncio
 import os
 from pydantic import BaseModel
 
@@ -37,11 +39,10 @@ def get_password_hash(password) -> str:
     return pwd_context.hash(password)
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)) -> User:
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        user_id: int = payload.get("sub")
-        assert user_id is not None
+        assert payload.get("sub") is not None
     except jwt.ExpiredSignatureError:
         raise HTTPException(# pylint: disable=raise-missing-from
             status_code=401, detail="Token has expired"
@@ -50,29 +51,58 @@ def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)) ->
         raise HTTPException(# pylint: disable=raise-missing-from
             status_code=401, detail="Could not validate credentials"
         )
-    db_user: User | None = user.get_user(db, user_id)
+    return payload
+
+
+def _user_of(payload: dict, db) -> User:
+    db_user: User | None = user.get_user(db, payload["sub"])
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
-def check_admin_privilege(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
-    user_data: User = get_current_user(token, db)
-    if not user_data.is_admin:
-        raise HTTPException(status_code=403, detail="Unauthorized")
-    admin: Admin | None = user.get_admin_by_user_id(db, user_data.id)
+# The auth dependencies open their own read-only session instead of depending on get_db: a session
+# from get_db keeps its connection until the end of the request, while the route takes another one,
+# so that enough concurrent requests would exhaust the pool and wait for each other.
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """
+    The user of the token. Users are cached for a short time by crud.user, so this rarely queries the database.
+    """
+    payload = decode_token(token)
+    with ReadSessionLocal() as db:
+        return _user_of(payload, db)
+
+
+def check_admin_privilege(token: str = Depends(oauth2_scheme)):
+    """
+    The privileges of the admin of the token.
+
+    They are signed claims of the tokens minted by create_token, so no query is needed.
+    Tokens without them, minted before the claims existed, are checked against the database.
+    """
+    payload = decode_token(token)
+    if payload.get("is_admin") and payload.get("privileges") is not None:
+        return payload["privileges"]
+    with ReadSessionLocal() as db:
+        user_data: User = _user_of(payload, db)
+        if not user_data.is_admin:
+            raise HTTPException(status_code=403, detail="Unauthorized")
+        admin: Admin | None = user.get_admin_by_user_id(db, user_data.id)
     if admin is None:
         raise HTTPException(status_code=403, detail="Unauthorized")
     return admin.privileges.split(",")
 
 def create_token(
-    user_id: int, is_admin: bool, time_expire=timedelta(minutes=15)
+    user_id: int, is_admin: bool, time_expire=timedelta(minutes=15), privileges: list[str] | None = None
 ) -> Token:
     payload = {
         "sub": user_id,
         "is_admin": is_admin,
         "exp": datetime.now() + time_expire,
     }
+    if is_admin and privileges is not None:
+        payload["privileges"] = privileges
     payload_refresh = {
         "sub": user_id,
         "exp": datetime.now() + timedelta(days=14),
@@ -80,43 +110,68 @@ def create_token(
     return Token(access_token=jwt.encode(payload, SECRET_KEY, algorithm="HS256"), refresh_token=jwt.encode(payload_refresh, SECRET_KEY, algorithm="HS256"))
 
 
-def authenticate_user(username: str, password: str, db):
+def create_user_token(db, user_in_db: User) -> Token:
+    """
+    Mint the token of a user, with the privileges of the admin if the user is one.
+    """
+    if not user_in_db.is_admin:
+        return create_token(user_in_db.id, False)
+    admin: Admin | None = user.get_admin_by_user_id(db, user_in_db.id)
+    return create_token(user_in_db.id, True, privileges=admin.privileges.split(",") if admin else None)
+
+
+def sso_unavailable(e: sdu_sso.Unavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="SSO service unavailable, please retry later",
+        headers={"Retry-After": str(max(1, int(e.retry_after)))},
+    )
+
+
+async def authenticate_user(username: str, password: str, db):
+    """
+    The SSO exchange is awaited on the event loop, the database and bcrypt run in the threadpool.
+    """
     # check if username exists
-    user_in_db: User | None = user.get_user_by_sdu_id(db, username)
+    user_in_db: User | None = await run_in_threadpool(user.get_user_by_sdu_id, db, username)
     if user_in_db is None:
         # This user has never logged in before, so we try to register the user via sdu sso.
         # But another situation is that this user is an admin with no sdu_id.
         # check if admin login system successful.
-        admin_in_db: Admin | None = user.get_admin_by_username(db, username)
+        admin_in_db: Admin | None = await run_in_threadpool(user.get_admin_by_username, db, username)
         if admin_in_db is None:
             # This is not an admin, so we try to register the user via sdu sso
             try:
-                name, sdu_id = sdu_sso.get_user_name_and_id(
-                    sdu_sso.login(username, password)
+                name, sdu_id = await sdu_sso.get_user_name_and_id(
+                    await sdu_sso.login(username, password)
                 )
+            except sdu_sso.Unavailable as e:
+                raise sso_unavailable(e)
             except:
                 raise HTTPException(  # pylint: disable=raise-missing-from
                     status_code=401, detail="Invalid credentials"
                 )
-            user_in_db = user.register_user(db, name, sdu_id)
-            return create_token(user_in_db.id, user_in_db.is_admin)
+            user_in_db = await run_in_threadpool(user.register_user, db, name, sdu_id)
+            await asyncio.to_thread(sdu_sso.credentials.remember, username, password)
+            return await run_in_threadpool(create_user_token, db, user_in_db)
         else:
             # This is an admin, so we try to login via admin system.
             # check if password is correct.
-            if verify_password(password, admin_in_db.password):
-                return create_token(admin_in_db.user_id, True)
+            if await run_in_threadpool(verify_password, password, admin_in_db.password):
+                return create_token(admin_in_db.user_id, True, privileges=admin_in_db.privileges.split(","))
             raise HTTPException(status_code=401, detail="Invalid credentials")
     else:
         # This user has a record in users table, user_in_db not None
-        # use sdu sso to login and return the token
+        # only the credentials need checking via sdu sso, then return the token
         try:
-            sTicket = sdu_sso.login(username, password)
-            name, sdu_id = sdu_sso.get_user_name_and_id(sTicket)
+            await sdu_sso.verify_credentials(username, password)
+        except sdu_sso.Unavailable as e:
+            raise sso_unavailable(e)
         except:
             raise HTTPException(    # pylint: disable=raise-missing-from
                 status_code=401, detail="Invalid credentials"
             )
-        return create_token(user_in_db.id, user_in_db.is_admin)
+        return await run_in_threadpool(create_user_token, db, user_in_db)
 
 
 @router.get("/me", response_model=UserData)
@@ -125,10 +180,10 @@ def read_users_me(current_user: Annotated[User, Depends(get_current_user)]) -> U
 
 
 @router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db=Depends(get_db)
 ):
-    return authenticate_user(form_data.username, form_data.password, db)
+    return await authenticate_user(form_data.username, form_data.password, db)
 
 @router.post("/token/refresh")
 def refresh_token(token: Token):
@@ -145,9 +200,24 @@ def refresh_token(token: Token):
         raise HTTPException(
             status_code=401, detail="Could not validate credentials"
         )
-    return create_token(user_id, payload.get("is_admin"))
+    # the admin flag and privileges are read again rather than carried over from the old token,
+    # so that revoking an admin takes effect when the current access token expires
+    with ReadSessionLocal() as db:
+        db_user: User | None = db.get(User, user_id)
+        if db_user is None:
+            raise HTTPException(status_code=401, detail="Could not validate credentials")
+        return create_user_token(db, db_user)
 
 
+@router.post("/batch", response_model=BatchResult[UserPublic])
+async def read_users_by_ids(
+    query: BatchQuery, db=Depends(get_read_session), current_user: User = Depends(get_current_user)
+):
+    """
+    The public data of a list of users, e.g. the authors of the comments of a dish.
+    """
+    return await aio.run(db, batch.get_many, User, query.ids)
+
 @router.get("/users/{user_id}", response_model=UserData)
 def read_user(
     user_id: int, db=Depends(get_db), current_user: User = Depends(get_current_user)
@@ -187,19 +257,19 @@ def read_admin_me(
     return ret
 
 @router.patch("/me/image")
-async def update_user_image(image: str, db=Depends(get_db), current_user: User = Depends(get_current_user)):
+async def update_user_image(image: str, db=Depends(get_session), current_user: User = Depends(get_current_user)):
     try:
-        user.update_user_image(db, current_user.id, image)
+        await aio.run(db, user.update_user_image, current_user.id, image)
     except ValueError:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "Image updated successfully"}
 
 @router.put("/{uid}", response_model=UserData)
-async def update_user(uid: int, data: UserData, db=Depends(get_db), current_user: User = Depends(get_current_user)):
+async def update_user(uid: int, data: UserData, db=Depends(get_session), current_user: User = Depends(get_current_user)):
     if not current_user.is_admin or current_user.id != uid or data.id != uid or data.id != current_user.id:
         raise HTTPException(status_code=401, detail="Unauthorized")
     try:
-        user.update_user(db, uid, data)
+        await aio.run(db, user.update_user, uid, data)
     except ValueError:
         raise HTTPException(status_code=404, detail="User not found")
-    return user.get_user(db, uid)
+    return await aio.run(db, user.get_user, uid)